@@ -11,6 +11,7 @@
     __project__     = "PyTerrainModeler"
 """
 
+import json
 import logging
 from argparse import ArgumentParser
 import os
@@ -24,6 +25,10 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-d", "--debug", action="store_true", help="Turn on debug logging")
     parser.add_argument("-n", "--draft", action="store_true", help="Turn on lower-res draft logging")
+    parser.add_argument("-p", "--plan", action="store_true",
+                        help="Print the tiles, model size and memory the model needs, without building it")
+    parser.add_argument("-c", "--calibrate", action="store_true",
+                        help="Print the plan with a timing of each stage from a few sampled strips")
     args = parser.parse_args()
     if args.debug:
         logLevel = logging.DEBUG
@@ -62,7 +67,12 @@ if __name__ == '__main__':
                                                                       # I moved this until it did.
                                                                       flatten_factor=0.9,  # squish the mountains down a bit.
                                                                       flatten_mode=pyterrainmodeler.terrain_modeler.FlattenMode.POSITIVE,
-                                                                      geotiff_folder=os.path.join(os.getcwd(), "MapZen"))
+                                                                      geotiff_folder=os.path.join(os.getcwd(), "MapZen"),
+                                                                      use_overviews=args.draft)
+    if args.plan or args.calibrate:
+        print(json.dumps(terrain_modeler.plan(calibrate=args.calibrate), indent=4))
+        exit(0)
+
     logging.info(f"Saving STL")
     stl_file_name = os.path.join(os.getcwd(), "terrain.stl")
     terrain_modeler.save_stl(filename=stl_file_name)
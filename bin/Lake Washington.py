@@ -13,6 +13,7 @@
     __project__     = "PyTerrainModeler"
 """
 
+import json
 import logging
 from argparse import ArgumentParser
 import os
@@ -25,6 +26,10 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-d", "--debug", action="store_true", help="TUrn on debug logging")
     parser.add_argument("-n", "--draft", action="store_true", help="TUrn on lower-res draft logging")
+    parser.add_argument("-p", "--plan", action="store_true",
+                        help="Print the tiles, model size and memory the model needs, without building it")
+    parser.add_argument("-c", "--calibrate", action="store_true",
+                        help="Print the plan with a timing of each stage from a few sampled strips")
     args = parser.parse_args()
     if args.debug:
         logLevel = logging.DEBUG
@@ -49,15 +54,13 @@ if __name__ == '__main__':
     # So you need to provide that for each file.
     # {surface elevation (in m): [file, file, file, ... ],
     #  surface elevation (in m): [file, file, file, ... ]}
-    # First please know that the code for these is slow and not multiprocessor yet.
     # I only recently wrote it and it's subject to change (specifically I think I am
     # going to add a "tolerance" here for how close to surface level is "ok")
     # But I need to work on that code and thus far have never printed a model using it
     # I REALLY want to try and a lake depth print of something like Lake Tahoe.....but
     # SOOOO many projects and only one Unintelligible Maker.
     # Note: while EVERYTHING else is in meters: these files appear to all be in feet.
-    # I need to make that a parameter per file......## TODO
-    # but as before this is new in development code.  :)
+    # Feet is the default, for a file in meters use (file, DepthUnit.METERS) instead of just the file.
     xyz_config = {5.7: [os.path.join(xyz_folder, "H11292.xyz"),
                         os.path.join(xyz_folder, "H11293.xyz"),
                         os.path.join(xyz_folder, "H11810.xyz"),
@@ -81,10 +84,15 @@ if __name__ == '__main__':
         flatten_factor=1,
         flatten_mode=pyterrainmodeler.terrain_modeler.FlattenMode.POSITIVE,
         geotiff_folder=os.path.join(os.getcwd(), "MapZen"),
+        use_overviews=args.draft,
         xyz_config=xyz_config,  # Comment this line out to skip the xyz files and see both the
         # difference in model and processing time.
     )
 
+    if args.plan or args.calibrate:
+        print(json.dumps(terrain_modeler.plan(calibrate=args.calibrate), indent=4))
+        exit(0)
+
     stl_file_name = "terrain.stl"
     logging.info(f"Saving STL file: {stl_file_name}")
     terrain_modeler.save_stl(filename=stl_file_name)
@@ -11,6 +11,7 @@
     __project__     = "PyTerrainModeler"
 """
 
+import json
 import logging
 from argparse import ArgumentParser
 import os
@@ -23,6 +24,10 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-d", "--debug", action="store_true", help="Turn on debug logging")
     parser.add_argument("-n", "--draft", action="store_true", help="Turn on lower-res draft logging")
+    parser.add_argument("-p", "--plan", action="store_true",
+                        help="Print the tiles, model size and memory the model needs, without building it")
+    parser.add_argument("-c", "--calibrate", action="store_true",
+                        help="Print the plan with a timing of each stage from a few sampled strips")
     args = parser.parse_args()
     if args.debug:
         logLevel = logging.DEBUG
@@ -55,7 +60,12 @@ if __name__ == '__main__':
                                                                       offset_elevation=-50,  # Push the bottom of the model to -50m elevation
                                                                       min_allowed_z=0.22,  # Push the sea level back up to sea level by trial an error.
                                                                       # TODO add min_allowed_elevation
-                                                                      geotiff_folder=os.path.join(os.getcwd(), "MapZen"))
+                                                                      geotiff_folder=os.path.join(os.getcwd(), "MapZen"),
+                                                                      use_overviews=args.draft)
+    if args.plan or args.calibrate:
+        print(json.dumps(terrain_modeler.plan(calibrate=args.calibrate), indent=4))
+        exit(0)
+
     logging.info(f"Saving STL")
     stl_file_name = os.path.join(os.getcwd(), "terrain.stl")
     terrain_modeler.save_stl(filename=stl_file_name)
@@ -13,6 +13,7 @@
     __project__     = "PyTerrainModeler"
 """
 
+import json
 import logging
 from argparse import ArgumentParser
 import os
@@ -25,6 +26,10 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-d", "--debug", action="store_true", help="TUrn on debug logging")
     parser.add_argument("-n", "--draft", action="store_true", help="TUrn on lower-res draft logging")
+    parser.add_argument("-p", "--plan", action="store_true",
+                        help="Print the tiles, model size and memory the model needs, without building it")
+    parser.add_argument("-c", "--calibrate", action="store_true",
+                        help="Print the plan with a timing of each stage from a few sampled strips")
     args = parser.parse_args()
     if args.debug:
         logLevel = logging.DEBUG
@@ -50,7 +55,12 @@ if __name__ == '__main__':
                                                                       steps_y=x_y_steps,  # 1000 steps (1000 steps or 0.2 mm resolution on full size)
                                                                       scale_z=1.25,  # Make z features 1.25x the scale as x/y, make it 25% taller because it looks better!
                                                                       offset_elevation=400,  # If 0 is sea level, the whole base gets kinda tall.  I want to push that down soo the base is not as tall.
-                                                                      geotiff_folder=os.path.join(os.getcwd(), "MapZen"))
+                                                                      geotiff_folder=os.path.join(os.getcwd(), "MapZen"),
+                                                                      use_overviews=args.draft)  # Drafts sample from downsampled copies of the geotiffs, which is much quicker.
+    if args.plan or args.calibrate:
+        print(json.dumps(terrain_modeler.plan(calibrate=args.calibrate), indent=4))
+        exit(0)
+
     logging.info(f"Saving STL")
     stl_file_name = os.path.join(os.getcwd(), "terrain.stl")
     terrain_modeler.save_stl(filename=stl_file_name)
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+"""benchmark.py:
+    This times each stage of building a model, on synthetic tiles it makes itself, so it runs anywhere without the
+    MapZen download and gives the same numbers run after run on the same machine.  The tiles are fractal terrain
+    (spectral synthesis, seeded), with lakes flattened to a fixed surface elevation like the water in the MapZen
+    data.  There is a bowl where four tiles meet, and the map sits over it, so the grid, the lake and the soundings all
+    cross tile edges.  The soundings are taken from the terrain under the lakes, so they carve the bowl back out.
+
+    The stages are timed separately, for every combination of --steps and --processes, best of --repeat runs:
+        decode: decoding the tiles into the decoded tile folder, once, before everything else
+        sampling: sampling the grid (TerrainModeler._sample_grid)
+        soundings_load: parsing the xyz file (TerrainModeler._load_soundings)
+        soundings_apply: carving the soundings into the grid (TerrainModeler._apply_soundings)
+        triangulation: the side and strip faces of every block, without writing them (Modeler.get_side_faces and
+            Modeler.get_strip_faces)
+        save_model: z heights, faces and writing the STL (TerrainModeler._save_model)
+        save_stl: all of it, from a new TerrainModeler (TerrainModeler.save_stl)
+    The results are saved as JSON.  Give --baseline a saved result to compare against, and every stage that got more
+    than --threshold slower is flagged as a regression, and the exit code is 1.  --input compares a saved result
+    instead of running.
+
+    e.g. python3 ./bin/benchmark.py --steps 200 500 --processes 1 8 --output before.json
+         ... change something ...
+         python3 ./bin/benchmark.py --steps 200 500 --processes 1 8 --output after.json --baseline before.json
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+from argparse import ArgumentParser
+import gzip
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pyterrainmodeler.terrain_modeler
+from pyterrainmodeler.modeler import Modeler
+from mapzen_hgt_to_geotiff import convert_tile
+
+# The four tiles N46W123, N46W122, N47W123 and N47W122, which meet at 47N 122W.
+SOUTH = 46
+WEST = -123
+TILES_NORTH_SOUTH = 2
+TILES_EAST_WEST = 2
+RELIEF = 1800
+BOWL_DEPTH = 400
+WATER_SURFACE = 200
+FEET_PER_METER = 3.28084
+# About 22km square over the corner the tiles meet at.
+MAP_LATITUDE = 46.9
+MAP_LONGITUDE = -122.15
+MAP_LONGITUDE_SIZE = 0.3
+MAP_SIZE = 200
+STAGES = ["sampling", "soundings_load", "soundings_apply", "triangulation", "save_model", "save_stl"]
+
+
+def make_terrain(samples, seed):
+    """
+    :param samples: The samples on each side of a tile, like 1201 for 3 arc second tiles
+    :param seed: The seed of the random terrain
+    :return: (elevations, water depths) NumPy arrays covering all the tiles, north row first, one sample per tile
+        edge shared with the next tile like .hgt files do.  The elevations are int16 meters, and the water depths are
+        how far the terrain is below the WATER_SURFACE (0 where it isn't).
+    """
+    rows = (TILES_NORTH_SOUTH * (samples - 1)) + 1
+    columns = (TILES_EAST_WEST * (samples - 1)) + 1
+    random = np.random.default_rng(seed)
+    # Fractal noise is white noise with each frequency scaled down by a power of it.
+    frequencies = np.hypot(np.fft.fftfreq(rows)[:, np.newaxis], np.fft.rfftfreq(columns)[np.newaxis, :])
+    frequencies[0, 0] = np.inf
+    spectrum = np.fft.rfft2(random.standard_normal((rows, columns))) / np.power(frequencies, 1.1)
+    noise = np.fft.irfft2(spectrum, s=(rows, columns))
+    noise = (noise - noise.min()) / (noise.max() - noise.min())
+
+    row_distances = np.arange(rows)[:, np.newaxis] - ((TILES_NORTH_SOUTH - 1) * (samples - 1))
+    column_distances = np.arange(columns)[np.newaxis, :] - ((TILES_EAST_WEST - 1) * (samples - 1))
+    bowl = np.minimum(np.hypot(row_distances, column_distances) / (samples / 8), 1)
+    terrain = (RELIEF * noise * bowl) + (BOWL_DEPTH * bowl) - (BOWL_DEPTH / 2)
+    depths = np.maximum(WATER_SURFACE - terrain, 0)
+    elevations = np.where(depths > 0, WATER_SURFACE, np.round(terrain)).astype(np.int16)
+    return elevations, depths
+
+
+def write_tiles(folder, elevations, samples, tile_format):
+    """
+    :param folder: The folder to write the tiles to, in N00 - S90 folders like the MapZen data
+    :param elevations: The elevations from make_terrain
+    :param samples: The samples on each side of a tile
+    :param tile_format: "geotiff", "hgt" or "hgt.gz"
+    :return: None
+    """
+    for north_south in range(TILES_NORTH_SOUTH):
+        for east_west in range(TILES_EAST_WEST):
+            latitude = SOUTH + TILES_NORTH_SOUTH - 1 - north_south
+            longitude = WEST + east_west
+            name = f"N{latitude:02d}W{-longitude:03d}"
+            os.makedirs(os.path.join(folder, name[:3]), exist_ok=True)
+            tile = elevations[north_south * (samples - 1):(north_south * (samples - 1)) + samples,
+                              east_west * (samples - 1):(east_west * (samples - 1)) + samples]
+            data = tile.astype(">i2").tobytes()
+            hgt_filename = os.path.join(folder, name[:3], f"{name}.hgt")
+            if tile_format == "hgt.gz":
+                with gzip.open(f"{hgt_filename}.gz", "wb") as f:
+                    f.write(data)
+                continue
+            with open(hgt_filename, "wb") as f:
+                f.write(data)
+            if tile_format == "geotiff":
+                convert_tile((hgt_filename, os.path.join(folder, name[:3], f"{name}.tiff"), True))
+
+
+def write_soundings(xyz_filename, depths, samples, soundings, seed):
+    """
+    Write a NOAA style (TYPE_A, depths in feet) xyz file of soundings at random spots in the water.
+    :param xyz_filename: The xyz file to write
+    :param depths: The water depths from make_terrain
+    :param samples: The samples on each side of a tile
+    :param soundings: How many soundings to write
+    :param seed: The seed of the random spots
+    :return: None
+    """
+    random = np.random.default_rng(seed)
+    rows, columns = np.nonzero(depths)
+    picks = random.integers(0, len(rows), soundings)
+    latitudes = SOUTH + TILES_NORTH_SOUTH - ((rows[picks] + random.uniform(-0.5, 0.5, soundings)) / (samples - 1))
+    longitudes = WEST + ((columns[picks] + random.uniform(-0.5, 0.5, soundings)) / (samples - 1))
+    feet = depths[rows[picks], columns[picks]] * FEET_PER_METER
+    with open(xyz_filename, "w") as f:
+        f.write("survey_id,lat,long,depth,quality_code,active\n")
+        np.savetxt(f, np.column_stack((latitudes, longitudes, feet)), fmt="BENCHMARK,%.7f,%.7f,%.2f,1,1")
+
+
+def get_terrain_modeler(folder, xyz_filename, steps, processes):
+    """
+    :param folder: The folder with the synthetic tiles
+    :param xyz_filename: The synthetic xyz file
+    :param steps: The steps in x and y
+    :param processes: The max_processes
+    :return: A new TerrainModeler of the benchmark map, with nothing sampled or cached
+    """
+    return pyterrainmodeler.terrain_modeler.TerrainModeler(latitude=MAP_LATITUDE,
+                                                           longitude=MAP_LONGITUDE,
+                                                           longitude_size=MAP_LONGITUDE_SIZE,
+                                                           size_x=MAP_SIZE,
+                                                           size_y=MAP_SIZE,
+                                                           steps_x=steps,
+                                                           steps_y=steps,
+                                                           scale_z=2,
+                                                           geotiff_folder=folder,
+                                                           xyz_config={WATER_SURFACE: [xyz_filename]},
+                                                           max_processes=processes)
+
+
+def time_stages(folder, xyz_filename, steps, processes):
+    """
+    :param folder: The folder with the synthetic tiles
+    :param xyz_filename: The synthetic xyz file
+    :param steps: The steps in x and y
+    :param processes: The max_processes
+    :return: dict of the seconds each of the STAGES took
+    """
+    seconds = {}
+    stl_filename = os.path.join(folder, "benchmark.stl")
+    terrain_modeler = get_terrain_modeler(folder=folder, xyz_filename=xyz_filename, steps=steps, processes=processes)
+    xyz_config = terrain_modeler.xyz_config
+    terrain_modeler.xyz_config = None
+    start = time.perf_counter()
+    terrain_modeler._sample_grid()
+    seconds["sampling"] = time.perf_counter() - start
+    terrain_modeler.xyz_config = xyz_config
+    try:
+        start = time.perf_counter()
+        soundings = terrain_modeler._load_soundings()
+        seconds["soundings_load"] = time.perf_counter() - start
+
+        latitudes, longitudes, elevations = terrain_modeler.map_grid.array
+        elevations = elevations.copy()
+        start = time.perf_counter()
+        terrain_modeler._apply_soundings(soundings=soundings,
+                                         latitudes=latitudes,
+                                         longitudes=longitudes,
+                                         elevations=elevations)
+        seconds["soundings_apply"] = time.perf_counter() - start
+        del latitudes, longitudes
+
+        modeler = Modeler(size_x=MAP_SIZE, size_y=MAP_SIZE, steps_x=steps, steps_y=steps)
+        block_steps = terrain_modeler._get_block_steps()
+        start = time.perf_counter()
+        modeler.get_side_faces(front_z=terrain_modeler._get_z_for_elevations(elevations=elevations[:, 0]),
+                               rear_z=terrain_modeler._get_z_for_elevations(elevations=elevations[:, steps]),
+                               left_z=terrain_modeler._get_z_for_elevations(elevations=elevations[0]),
+                               right_z=terrain_modeler._get_z_for_elevations(elevations=elevations[steps]))
+        for block_start in range(0, steps, block_steps):
+            z_grid = terrain_modeler._get_z_for_elevations(elevations=elevations[block_start:block_start + block_steps + 1])
+            modeler.get_strip_faces(x_step=block_start, z_grid=z_grid)
+        seconds["triangulation"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        terrain_modeler._save_model(elevations=elevations, filename=stl_filename)
+        seconds["save_model"] = time.perf_counter() - start
+    finally:
+        terrain_modeler.map_grid.close()
+        terrain_modeler.map_grid = None
+
+    terrain_modeler = get_terrain_modeler(folder=folder, xyz_filename=xyz_filename, steps=steps, processes=processes)
+    start = time.perf_counter()
+    terrain_modeler.save_stl(filename=stl_filename)
+    seconds["save_stl"] = time.perf_counter() - start
+    os.remove(stl_filename)
+    return seconds
+
+
+def run(folder, all_steps, all_processes, repeat, samples, soundings, tile_format, seed):
+    """
+    :param folder: An empty folder to make the tiles and xyz file in
+    :param all_steps: list of the steps to time
+    :param all_processes: list of the process counts to time
+    :param repeat: How many times to time each one.  The best is kept.
+    :param samples: The samples on each side of a tile
+    :param soundings: How many soundings to make
+    :param tile_format: "geotiff", "hgt" or "hgt.gz"
+    :param seed: The seed of the terrain and soundings
+    :return: dict of the results, ready for json.dump
+    """
+    logging.info(f"Making {TILES_NORTH_SOUTH * TILES_EAST_WEST} {samples}x{samples} {tile_format} tiles in {folder}")
+    elevations, depths = make_terrain(samples=samples, seed=seed)
+    write_tiles(folder=folder, elevations=elevations, samples=samples, tile_format=tile_format)
+    xyz_filename = os.path.join(folder, "soundings.xyz")
+    write_soundings(xyz_filename=xyz_filename, depths=depths, samples=samples, soundings=soundings, seed=seed)
+    del elevations, depths
+
+    results = []
+    terrain_modeler = get_terrain_modeler(folder=folder, xyz_filename=xyz_filename, steps=all_steps[0],
+                                          processes=max(all_processes))
+    start = time.perf_counter()
+    terrain_modeler._open_elevations()
+    decode_seconds = time.perf_counter() - start
+    results.append({"stage": "decode", "steps": None, "processes": None, "seconds": decode_seconds,
+                    "runs": [decode_seconds]})
+
+    for steps in all_steps:
+        for processes in all_processes:
+            runs = [time_stages(folder=folder, xyz_filename=xyz_filename, steps=steps, processes=processes)
+                    for run_index in range(repeat)]
+            for stage in STAGES:
+                stage_runs = [stage_seconds[stage] for stage_seconds in runs]
+                results.append({"stage": stage, "steps": steps, "processes": processes,
+                                "seconds": min(stage_runs), "runs": stage_runs})
+                logging.info(f"{steps} steps, {processes} processes, {stage}: {min(stage_runs):.3f}s")
+
+    return {"settings": {"samples": samples, "soundings": soundings, "tile_format": tile_format, "seed": seed,
+                         "repeat": repeat},
+            "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                        "numpy": np.__version__, "cpu_count": os.cpu_count()},
+            "results": results}
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """
+    :param results: The results from run
+    :param baseline: Earlier results from run to compare against
+    :param threshold: The fraction slower than the baseline that counts as a regression, like 0.1 for 10%
+    :param min_seconds: Differences smaller than this are noise, however big a fraction they are
+    :return: list of the results that regressed, each with the baseline seconds added
+    """
+    baseline_seconds = {(result["stage"], result["steps"], result["processes"]): result["seconds"]
+                        for result in baseline["results"]}
+    if results["settings"] != baseline["settings"]:
+        logging.warning(f"The baseline settings {baseline['settings']} are not these {results['settings']}")
+    regressions = []
+    for result in results["results"]:
+        key = (result["stage"], result["steps"], result["processes"])
+        if key not in baseline_seconds:
+            continue
+        before = baseline_seconds[key]
+        change = (result["seconds"] - before) / before if before else 0
+        regressed = change > threshold and result["seconds"] - before > min_seconds
+        print(f"{result['stage']:>16} {str(result['steps']):>6} {str(result['processes']):>4} "
+              f"{before:10.3f}s {result['seconds']:10.3f}s {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(dict(result, baseline_seconds=before))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--steps", type=int, nargs="+", default=[200, 500], help="The steps in x and y to time. Default is 200 500.")
+    parser.add_argument("-p", "--processes", type=int, nargs="+", default=[1, os.cpu_count()], help="The max_processes to time. Default is 1 and one per CPU.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="How many times to time each one. The best is kept. Default is 3.")
+    parser.add_argument("-o", "--output", help="The JSON file to save the results to.")
+    parser.add_argument("-b", "--baseline", help="Saved results to compare against. Regressions make the exit code 1.")
+    parser.add_argument("-i", "--input", help="Compare these saved results to the baseline instead of running.")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1, help="How much slower is a regression. Default is 0.1 (10%%).")
+    parser.add_argument("-m", "--min-seconds", type=float, default=0.05, help="Differences under this many seconds are never regressions. Default is 0.05.")
+    parser.add_argument("-f", "--tile-format", choices=["geotiff", "hgt", "hgt.gz"], default="geotiff", help="The tiles to make. Default is geotiff.")
+    parser.add_argument("--samples", type=int, default=1201, help="The samples on each side of a tile. Default is 1201, like 3 arc second MapZen tiles.")
+    parser.add_argument("--soundings", type=int, default=200000, help="The soundings to make. Default is 200000.")
+    parser.add_argument("--seed", type=int, default=1, help="The seed of the terrain and soundings. Default is 1.")
+    parser.add_argument("-w", "--work-folder", help="The folder to make the tiles in. Default is a temporary folder, removed afterwards.")
+    parser.add_argument("-d", "--debug", action="store_true", help="Turn on debug logging")
+
+    args = parser.parse_args()
+    logFormat = '%(asctime)s - %(filename)s.%(lineno)s - %(levelname)s -  %(process)d: %(message)s'
+    logging.basicConfig(format=logFormat, level=logging.DEBUG if args.debug else logging.INFO)
+    logging.debug(f"Args: {args}")
+
+    if args.input:
+        with open(args.input) as f:
+            results = json.load(f)
+    else:
+        work_folder = args.work_folder or tempfile.mkdtemp(prefix="pyterrainmodeler_benchmark_")
+        if os.path.exists(work_folder) and os.listdir(work_folder):
+            parser.error(f"The work folder {work_folder} isn't empty.")
+        os.makedirs(work_folder, exist_ok=True)
+        try:
+            results = run(folder=work_folder, all_steps=args.steps, all_processes=args.processes, repeat=args.repeat,
+                          samples=args.samples, soundings=args.soundings, tile_format=args.tile_format, seed=args.seed)
+        finally:
+            if args.work_folder is None:
+                shutil.rmtree(work_folder)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=4)
+            logging.info(f"Saved the results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results=results, baseline=baseline, threshold=args.threshold,
+                              min_seconds=args.min_seconds)
+        logging.info(f"{len(regressions)} regressions against {args.baseline}")
+        if regressions:
+            exit(1)
+    exit(0)
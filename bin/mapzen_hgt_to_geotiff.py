@@ -4,10 +4,16 @@
     This Python script converts MapZen HGT (Height) data files to the GeoTIFF format, which is a standard raster
     data format for geographic information systems (GIS). It allows you to specify the source folder containing
     the MapZen data and the destination folder for the converted GeoTIFF files (which can be the same), as well
-    as an option to remove the original HGT files after conversion to save on disk space. As this is a one-time
-    use script, to set up the data, and then never used again; I have not parallelized it in any way.  This also
-    aids in you reading it and seeing exactly what I am asking your computer to do with the sys calls.  I ran it
-    overnight.
+    as an option to remove the original HGT files after conversion to save on disk space.
+
+    The first version of this shelled out to gunzip, gdal_translate and gzip for every file, one at a time, and I ran
+    it overnight.  Now each tile is decompressed in Python and written as a DEFLATE GeoTIFF with tifffile (which the
+    geotiff package already installs), the same as `gdal_translate -co COMPRESS=DEFLATE -co PREDICTOR=2` makes, so
+    there is no GDAL needed and nothing uncompressed is left on the disk.  The tiles are converted in a pool of
+    processes.  Every finished tile is written to a manifest in the destination folder, so if it gets interrupted
+    just run it again and it picks up where it stopped.  Use --bounds to only convert the tiles a map needs.
+
+    You don't have to convert at all anymore, PyTerrainModeler reads the .hgt.gz files directly.  See README.
     __author__      = "Unintelligible Maker"
     __copyright__   = "Copyright 2024"
     __license__     = "GNU GPL v3"
@@ -17,8 +23,19 @@
 """
 
 from argparse import ArgumentParser
+import json
 import logging
+import math
 import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+import numpy as np
+import tifffile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyterrainmodeler.elevation_tile import ElevationTile, HGT_NAME_PATTERN
 
 LONGITUDE_FOLDERS = ["N00", "N01", "N02", "N03", "N04", "N05", "N06", "N07", "N08", "N09",
                      "N10", "N11", "N12", "N13", "N14", "N15", "N16", "N17", "N18", "N19",
@@ -40,11 +57,133 @@ LONGITUDE_FOLDERS = ["N00", "N01", "N02", "N03", "N04", "N05", "N06", "N07", "N0
                      "S80", "S81", "S82", "S83", "S84", "S85", "S86", "S87", "S88", "S89",
                      "S90"]
 
+MANIFEST_FILENAME = ".mapzen_hgt_to_geotiff.manifest"
+NODATA = -32768
+
+
+def get_tiles(source, destination, bounds=None):
+    """
+    :param source: The folder with the MapZen N00 - S90 folders
+    :param destination: The folder to write the GeoTiffs to, in the same N00 - S90 folders
+    :param bounds: (south, west, north, east) to only get the tiles touching that area, or None for all of them
+    :return: list of (hgt filename, tif filename) for every tile to convert
+    """
+    tiles = []
+    for longitude_folder in LONGITUDE_FOLDERS:
+        longitude_folder_path = os.path.join(source, longitude_folder)
+        if not os.path.isdir(longitude_folder_path):
+            continue
+        for listing in sorted(os.listdir(longitude_folder_path)):
+            match = HGT_NAME_PATTERN.search(listing)
+            if match is None:
+                continue
+            if bounds is not None:
+                south, west, north, east = bounds
+                latitude = int(match.group(2)) * (1 if match.group(1).upper() == "N" else -1)
+                longitude = int(match.group(4)) * (1 if match.group(3).upper() == "E" else -1)
+                if not (math.floor(south) <= latitude <= math.floor(north)
+                        and math.floor(west) <= longitude <= math.floor(east)):
+                    continue
+            tif_filename = os.path.join(destination, longitude_folder, listing.split(".")[0] + ".tiff")
+            tiles.append((os.path.join(longitude_folder_path, listing), tif_filename))
+    return tiles
+
+
+def read_manifest(manifest_filename):
+    """
+    :param manifest_filename: The manifest file, one JSON line per converted tile
+    :return: dict of tif filename to the record of its conversion.  A half written last line is ignored.
+    """
+    manifest = {}
+    if os.path.exists(manifest_filename):
+        with open(manifest_filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                manifest[record["tif"]] = record
+    return manifest
+
+
+def is_converted(hgt_filename, tif_filename, manifest):
+    """
+    :param hgt_filename: The MapZen file
+    :param tif_filename: The GeoTiff it converts to
+    :param manifest: The manifest from read_manifest
+    :return: True if the GeoTiff is there and is the one the manifest says was written from this MapZen file.  A
+        GeoTiff the manifest doesn't know about (say from the old gdal_translate version) counts if it is newer than
+        the MapZen file and reads as a square tile.
+    """
+    if not os.path.exists(tif_filename):
+        return False
+    record = manifest.get(tif_filename)
+    if record is None:
+        if os.path.getmtime(tif_filename) < os.path.getmtime(hgt_filename):
+            return False
+        try:
+            with tifffile.TiffFile(tif_filename) as tif:
+                height, width = tif.pages[0].shape[:2]
+        except (OSError, ValueError, IndexError, tifffile.TiffFileError):
+            return False
+        return height == width and height > 1
+    if os.path.getsize(tif_filename) != record["tif_size"]:
+        return False
+    # With --remove the MapZen file is gone once its tile is converted.
+    if os.path.exists(hgt_filename) and os.path.getsize(hgt_filename) != record["hgt_size"]:
+        return False
+    return True
+
+
+def convert_tile(tile):
+    """
+    Convert one tile.  The GeoTiff is written to a temporary file and renamed, so an interrupted run never leaves a
+    half written GeoTiff that looks finished.
+    :param tile: (hgt filename, tif filename, remove the hgt file when done)
+    :return: The record for the manifest, or None if the tile could not be converted
+    """
+    hgt_filename, tif_filename, remove = tile
+    try:
+        elevation_tile = ElevationTile.from_hgt(hgt_filename)
+        pixel_width = 1.0 / elevation_tile.x_scale
+        pixel_height = -1.0 / elevation_tile.y_scale
+        geotiff_tags = [(33550, 'd', 3, (pixel_width, pixel_height, 0.0)),
+                        (33922, 'd', 6, (0.0, 0.0, 0.0, elevation_tile.left, elevation_tile.top, 0.0)),
+                        # GTModelType geographic, GTRasterType pixel is area, GeographicType WGS 84
+                        (34735, 'H', 16, (1, 1, 0, 3, 1024, 0, 1, 2, 1025, 0, 1, 1, 2048, 0, 1, 4326)),
+                        (42113, 's', 0, str(NODATA))]
+        folder = os.path.dirname(tif_filename)
+        os.makedirs(folder, exist_ok=True)
+        file_descriptor, temporary_filename = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        os.close(file_descriptor)
+        try:
+            tifffile.imwrite(temporary_filename, np.asarray(elevation_tile.array, dtype=np.int16),
+                             compression='zlib', predictor=2, extratags=geotiff_tags)
+            os.replace(temporary_filename, tif_filename)
+        except BaseException:
+            os.remove(temporary_filename)
+            raise
+    except (OSError, EOFError, ValueError) as e:
+        logging.error(f"Could not convert {hgt_filename}: {e}")
+        return None
+
+    record = {"hgt": hgt_filename,
+              "hgt_size": os.path.getsize(hgt_filename),
+              "tif": tif_filename,
+              "tif_size": os.path.getsize(tif_filename)}
+    if remove:
+        os.remove(hgt_filename)
+    return record
+
+
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-d", "--destination", help="Folder the GeoTiffs should be saved to. Default is ./")
     parser.add_argument("-s", "--source", help="Folder the MapZen data is in. This is the N00 - S90 folders. Default is ./")
     parser.add_argument("-r", "--remove", action="store_true", help="Indicates if the original *.hgt.gz files should be deleted as the script runs.")
+    parser.add_argument("-b", "--bounds", type=float, nargs=4, metavar=("SOUTH", "WEST", "NORTH", "EAST"),
+                        help="Only convert the tiles touching this area. Default is every tile.")
+    parser.add_argument("-p", "--processes", type=int, help="How many tiles to convert at once. Default is one per CPU.")
 
     args = parser.parse_args()
     logFormat = '%(asctime)s - %(filename)s.%(lineno)s - %(levelname)s -  %(process)d: %(message)s'
@@ -63,16 +202,26 @@ if __name__ == '__main__':
 
     logging.debug(f"Args: {args}")
 
-    for longitude_folder in LONGITUDE_FOLDERS:
-        longitude_folder_path = os.path.join(args.source, longitude_folder)
-        for listing in os.listdir(longitude_folder_path):
-            if listing.endswith(".hgt.gz"):
-                hgt_gz_file = os.path.join(longitude_folder_path, listing)
-                os.system(f"gunzip {hgt_gz_file}")
-                hgt_file = hgt_gz_file.replace(".gz", "")
-                tif_filename = os.path.join(args.destination, longitude_folder, listing.replace(".hgt.gz", ".tiff"))
-                os.system(f"gdal_translate -co COMPRESS=DEFLATE -co PREDICTOR=2 {hgt_file} {tif_filename}")
-                if args.remove:
-                    os.remove(hgt_file)
-                else:
-                    os.system(f"gzip {hgt_file}")
+    manifest_filename = os.path.join(args.destination, MANIFEST_FILENAME)
+    manifest = read_manifest(manifest_filename)
+    tiles = get_tiles(source=args.source, destination=args.destination, bounds=args.bounds)
+    pending = [(hgt_filename, tif_filename, args.remove)
+               for hgt_filename, tif_filename in tiles
+               if not is_converted(hgt_filename=hgt_filename, tif_filename=tif_filename, manifest=manifest)]
+    logging.info(f"{len(tiles)} tiles, {len(tiles) - len(pending)} already converted, {len(pending)} to go")
+
+    os.makedirs(args.destination, exist_ok=True)
+    start = time.time()
+    converted = 0
+    failed = 0
+    with open(manifest_filename, "a") as manifest_file, Pool(processes=args.processes) as p:
+        for record in p.imap_unordered(convert_tile, pending):
+            if record is None:
+                failed += 1
+                continue
+            manifest_file.write(json.dumps(record) + "\n")
+            manifest_file.flush()
+            converted += 1
+            if converted % 100 == 0:
+                logging.info(f"Converted {converted} of {len(pending)} tiles in {time.time() - start:.0f}s")
+    logging.info(f"Converted {converted} tiles, {failed} failed, in {time.time() - start:.0f}s")
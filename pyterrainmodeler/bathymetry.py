@@ -0,0 +1,221 @@
+"""bathymetry.py:
+    This defines the Soundings, the depth measurements from NOAA (and other) XYZ bathymetry files as NumPy columns of
+    latitude, longitude and depth in meters.  The TerrainModeler uses them to carve lake and sea beds out of the flat
+    water surface in the elevation data.
+
+    The files are read a block of lines at a time, and each block is parsed with np.loadtxt straight into columns, so a
+    survey with millions of soundings never turns into millions of Python strings and floats.  Several files are
+    loaded at once in a pool of processes.  Given a cache folder, the parsed soundings are also saved there as a .npy
+    file, and later runs memory-map that instead of parsing the text again.
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import numpy as np
+from enum import Enum
+from itertools import islice
+from multiprocessing import Pool
+
+CHUNK_LINES = 2 ** 18
+COUNT_BLOCK_BYTES = 2 ** 24
+FEET_PER_METER = 3.28084
+
+
+class XYZFileTypes(Enum):
+    TYPE_A = 1
+    TYPE_B = 2
+
+
+class DepthUnit(Enum):
+    FEET = 1
+    METERS = 2
+
+
+class Soundings(object):
+
+    def __init__(self, latitudes, longitudes, depths):
+        """
+        :param latitudes: NumPy array of the latitudes of the soundings
+        :param longitudes: NumPy array of the longitudes of the soundings
+        :param depths: NumPy array of the depths below the water surface in meters
+        """
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.depths = depths
+
+    def __len__(self):
+        return len(self.depths)
+
+    def between_latitudes(self, south, north):
+        """
+        :param south: The southern latitude
+        :param north: The northern latitude
+        :return: Soundings with just the soundings from south to north, still in the order they were in
+        """
+        between = (self.latitudes >= south) & (self.latitudes < north)
+        return Soundings(latitudes=self.latitudes[between],
+                         longitudes=self.longitudes[between],
+                         depths=self.depths[between])
+
+    @staticmethod
+    def get_file_type(header):
+        """
+        :param header: The first line of an XYZ file
+        :return: The XYZFileTypes of the file
+        """
+        if header.count(',') == 5 and header.count('\t') == 0:
+            logging.info(f"Found TypeA File")
+            return XYZFileTypes.TYPE_A
+        if header.count(',') == 0 and header.count('\t') == 3:
+            logging.info(f"Found TypeB File")
+            return XYZFileTypes.TYPE_B
+        raise TypeError(f"File type is unknown. Pattern is: {header.count(',')}-{header.count(chr(9))}")
+
+    @staticmethod
+    def from_xyz(xyz_filename, depth_unit=DepthUnit.FEET, chunk_lines=CHUNK_LINES, cache_folder=None):
+        """
+        The first line of the file is the header, which is only used to tell the file type.
+            TYPE_A: survey_id,lat,long,depth,quality_code,active
+            TYPE_B: SURVEY<tab>LON<tab>LAT<tab>DEPTH
+        The soundings come back in the order they are in the file, which decides which sounding wins a grid point
+        that several are close to.
+        :param xyz_filename: The XYZ file to load
+        :param depth_unit: The unit of the depths in the file.  Default is DepthUnit.FEET, which the NOAA files use.
+        :param chunk_lines: The number of lines to parse at a time
+        :param cache_folder: Folder to keep the parsed soundings in, see get_cache_filename.  Default is None, which
+            parses the file every time.
+        :return: The Soundings in the file
+        """
+        cache_filename = None
+        if cache_folder is not None:
+            cache_filename = Soundings.get_cache_filename(xyz_filename=xyz_filename, depth_unit=depth_unit,
+                                                          cache_folder=cache_folder)
+            if os.path.exists(cache_filename):
+                logging.debug(f"Loading the parsed soundings of {xyz_filename} from {cache_filename}")
+                latitudes, longitudes, depths = np.load(cache_filename, mmap_mode='r')
+                return Soundings(latitudes=latitudes, longitudes=longitudes, depths=depths)
+
+        logging.debug(f"Loading XYZ file {xyz_filename}")
+        with open(xyz_filename) as f:
+            try:
+                file_type = Soundings.get_file_type(f.readline())
+            except TypeError as e:
+                raise TypeError(f"{xyz_filename}: {e}")
+            if file_type == XYZFileTypes.TYPE_A:
+                delimiter, columns = ',', (1, 2, 3)
+            else:
+                delimiter, columns = '\t', (2, 1, 3)
+
+            blocks = []
+            while True:
+                lines = list(islice(f, chunk_lines))
+                if not lines:
+                    break
+                blocks.append(np.loadtxt(lines, delimiter=delimiter, usecols=columns, dtype=np.float64, ndmin=2))
+        block = np.concatenate(blocks) if blocks else np.empty((0, 3), dtype=np.float64)
+
+        columns = block.T.copy()
+        if depth_unit == DepthUnit.FEET:
+            columns[2] /= FEET_PER_METER
+        logging.info(f"Loaded {len(block)} soundings from {xyz_filename}")
+        if cache_filename is not None:
+            os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+            file_descriptor, temporary_filename = tempfile.mkstemp(dir=os.path.dirname(cache_filename), suffix=".tmp")
+            try:
+                with os.fdopen(file_descriptor, "wb") as f:
+                    np.save(f, columns)
+                os.replace(temporary_filename, cache_filename)
+            except BaseException:
+                os.remove(temporary_filename)
+                raise
+            logging.debug(f"Saved the parsed soundings of {xyz_filename} to {cache_filename}")
+        latitudes, longitudes, depths = columns
+        return Soundings(latitudes=latitudes, longitudes=longitudes, depths=depths)
+
+    @staticmethod
+    def count_xyz(xyz_filename, depth_unit=DepthUnit.FEET, cache_folder=None):
+        """
+        Count the soundings in an XYZ file without parsing it, by its lines, or from the header of its parsed .npy
+        file if it is in the cache already.
+        :param xyz_filename: The XYZ file
+        :param depth_unit: The DepthUnit of the XYZ file, which is part of the cache filename
+        :param cache_folder: Folder the parsed soundings are kept in, see from_xyz.  Default is None.
+        :return: The number of soundings in the file
+        """
+        if cache_folder is not None:
+            cache_filename = Soundings.get_cache_filename(xyz_filename=xyz_filename, depth_unit=depth_unit,
+                                                          cache_folder=cache_folder)
+            if os.path.exists(cache_filename):
+                return np.load(cache_filename, mmap_mode='r').shape[1]
+        lines = 0
+        last = b""
+        with open(xyz_filename, "rb") as f:
+            while True:
+                block = f.read(COUNT_BLOCK_BYTES)
+                if not block:
+                    break
+                lines += block.count(b"\n")
+                last = block[-1:]
+        # The header doesn't count, and the last line may not end with a newline.
+        if last and last != b"\n":
+            lines += 1
+        return max(lines - 1, 0)
+
+    @staticmethod
+    def get_cache_filename(xyz_filename, depth_unit, cache_folder):
+        """
+        The parsed soundings are a (3, soundings) float64 .npy file of the latitudes, longitudes and depths in meters.
+        They stay float64 because a float32 longitude only resolves about half a meter, and the surveys are given to
+        the millimeter.  The name is a digest of the path, size and modification time of the XYZ file and its depth
+        unit, so an edited file is parsed again.  The soundings are kept in file order, and the order is in the digest
+        too, so files saved sorted by older versions aren't used.  Old ones are never removed.
+        :param xyz_filename: The XYZ file
+        :param depth_unit: The DepthUnit of the XYZ file
+        :param cache_folder: The folder to keep the parsed soundings in
+        :return: The .npy filename of the parsed soundings
+        """
+        description = {"filename": os.path.abspath(xyz_filename),
+                       "size": os.path.getsize(xyz_filename),
+                       "modified": os.path.getmtime(xyz_filename),
+                       "depth_unit": depth_unit.name,
+                       "order": "file"}
+        digest = hashlib.sha1(json.dumps(description).encode()).hexdigest()
+        return os.path.join(cache_folder, "soundings", f"{digest}.npy")
+
+    @staticmethod
+    def from_xyz_files(xyz_files, max_processes=None, cache_folder=None):
+        """
+        :param xyz_files: list of (XYZ filename, DepthUnit)
+        :param max_processes: The most files to load at once.  Default is one per CPU.  1 loads them in this process.
+        :param cache_folder: Folder to keep the parsed soundings in.  See from_xyz.  Files already in it are just
+            memory-mapped here, and only the rest go to the pool.
+        :return: list of the Soundings of each file, in the same order
+        """
+        if cache_folder is not None:
+            parsed = [os.path.exists(Soundings.get_cache_filename(xyz_filename=xyz_filename, depth_unit=depth_unit,
+                                                                  cache_folder=cache_folder))
+                      for xyz_filename, depth_unit in xyz_files]
+            if any(parsed):
+                unparsed_soundings = iter(Soundings.from_xyz_files(
+                    xyz_files=[xyz_file for xyz_file, is_parsed in zip(xyz_files, parsed) if not is_parsed],
+                    max_processes=max_processes,
+                    cache_folder=cache_folder))
+                return [Soundings.from_xyz(xyz_filename=xyz_filename, depth_unit=depth_unit, cache_folder=cache_folder)
+                        if is_parsed else next(unparsed_soundings)
+                        for (xyz_filename, depth_unit), is_parsed in zip(xyz_files, parsed)]
+        if max_processes == 1 or len(xyz_files) <= 1:
+            return [Soundings.from_xyz(xyz_filename=xyz_filename, depth_unit=depth_unit, cache_folder=cache_folder)
+                    for xyz_filename, depth_unit in xyz_files]
+        with Pool(min(len(xyz_files), max_processes or os.cpu_count())) as p:
+            return p.starmap(Soundings.from_xyz, [(xyz_filename, depth_unit, CHUNK_LINES, cache_folder)
+                                                  for xyz_filename, depth_unit in xyz_files])
@@ -0,0 +1,233 @@
+"""elevation_cache.py:
+    This defines the SharedElevationCache that the ElevationManager uses to remember elevations it has already looked
+    up.  It is a fixed size open addressing hash table stored in a SharedArray, so every gridding process reads and
+    writes the same table directly instead of going through a Manager server process.
+
+    The latitude and longitude are quantized to the ElevationManager resolution and packed into one integer key.  Each
+    slot is three 64 bit words: the key, the elevation as a float64, and a check value mixed from the two.  The
+    elevation is kept whole, so a cached elevation is exactly the one the GeoTIFF gave, and a run that hits the cache
+    builds the same model as one that doesn't.  Nothing is locked.  A reader only trusts a slot whose check matches the
+    key and elevation it found, so a slot torn by two processes writing at the same time reads as a miss rather than as
+    the wrong elevation.  Losing an entry that way only costs a second lookup in the GeoTIFF.
+
+    Given a filename, the table is kept in a memory-mapped file (a MappedArray) instead of shared memory, so the
+    elevations are still there for the next run.
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+import logging
+import os
+import struct
+import numpy as np
+from .shared_array import MappedArray, SharedArray
+
+MASK_64 = (1 << 64) - 1
+SLOT_MULTIPLIER = 0x9E3779B97F4A7C15
+MIX_MULTIPLIER = 0xBF58476D1CE4EB5B
+CHECK_MULTIPLIER = 0xC2B2AE3D27D4EB4F
+MAX_PROBES = 16
+SLOT_BYTES = 24
+
+
+class SharedElevationCache(object):
+
+    def __init__(self, resolution, capacity, filename=None):
+        """
+        :param resolution: The resolution (10 ^ -n) the latitude and longitude are quantized to.  See ElevationManager.
+        :param capacity: The number of elevations the cache should be able to hold.  The table is sized to twice this,
+            rounded up to a power of two, so it stays sparse enough for short probes.  When it is full, new elevations
+            are simply not cached.
+        :param filename: The file to keep the table in between runs.  None (default) keeps it in shared memory for
+            this run only.  An existing file at least as big as needed is reused, anything else is started over.
+        """
+        self.resolution = resolution
+        self.scale = 10 ** resolution
+        self.capacity = capacity
+        self.bits = max(int(2 * capacity - 1).bit_length(), 4)
+        if filename is None:
+            self.table = SharedArray(shape=(3, 1 << self.bits), dtype=np.uint64)
+        else:
+            if os.path.exists(filename):
+                existing_slots = os.path.getsize(filename) // SLOT_BYTES
+                existing_bits = existing_slots.bit_length() - 1
+                if (existing_bits >= self.bits and existing_slots == 1 << existing_bits
+                        and os.path.getsize(filename) == existing_slots * SLOT_BYTES):
+                    self.bits = existing_bits
+            self.table = MappedArray(filename=filename, shape=(3, 1 << self.bits), dtype=np.uint64)
+        self.slot_shift = 64 - self.bits
+        self.slot_mask = (1 << self.bits) - 1
+        logging.debug(f"Elevation cache: {1 << self.bits} slots for {capacity} elevations")
+
+    def close(self):
+        """
+        :return: None
+        """
+        self.table.close()
+
+    def get_key(self, latitude, longitude):
+        """
+        :param latitude: The latitude, already rounded to the resolution
+        :param longitude: The longitude, already rounded to the resolution
+        :return: The integer key for the location.  Never 0, as 0 marks an empty slot.
+        """
+        latitude_index = round(latitude * self.scale) + 90 * self.scale
+        longitude_index = round(longitude * self.scale) + 180 * self.scale
+        return ((latitude_index << 32) | longitude_index) + 1
+
+    def get_keys(self, latitudes, longitudes):
+        """
+        :param latitudes: NumPy array of latitudes, already rounded to the resolution
+        :param longitudes: NumPy array of longitudes, already rounded to the resolution
+        :return: NumPy array of the integer keys for the locations.  See get_key.
+        """
+        latitude_indexes = np.rint(latitudes * self.scale).astype(np.int64) + 90 * self.scale
+        longitude_indexes = np.rint(longitudes * self.scale).astype(np.int64) + 180 * self.scale
+        return ((latitude_indexes << 32) | longitude_indexes).astype(np.uint64) + np.uint64(1)
+
+    def _get_slots(self, keys):
+        """
+        :param keys: NumPy array of keys
+        :return: The first slot to probe for each key
+        """
+        # The keys of a grid form a regular lattice, which a bare multiplicative hash maps to long runs of
+        # neighbouring slots.  Folding the latitude into the longitude bits first breaks that up.
+        mixed = (keys ^ (keys >> np.uint64(31))) * np.uint64(MIX_MULTIPLIER)
+        mixed ^= mixed >> np.uint64(29)
+        return ((mixed * np.uint64(SLOT_MULTIPLIER)) >> np.uint64(self.slot_shift)).astype(np.int64)
+
+    @staticmethod
+    def _get_checks(keys, values):
+        """
+        Both multipliers are odd, so the check of a key and value only matches another key and value if both are
+        the same.
+        :param keys: NumPy array of keys
+        :param values: NumPy array of the float64 elevations as uint64 bits
+        :return: NumPy array of the check value for each key and value
+        """
+        return ((keys * np.uint64(CHECK_MULTIPLIER)) ^ values) * np.uint64(MIX_MULTIPLIER)
+
+    @staticmethod
+    def _get_check(key, value):
+        """
+        :param key: The key
+        :param value: The float64 elevation as uint64 bits
+        :return: The check value for the key and value.  The same as _get_checks for one key.
+        """
+        return ((((key * CHECK_MULTIPLIER) & MASK_64) ^ value) * MIX_MULTIPLIER) & MASK_64
+
+    def _get_slot(self, key):
+        """
+        :param key: The key
+        :return: The first slot to probe for the key.  The same as _get_slots for one key.
+        """
+        mixed = ((key ^ (key >> 31)) * MIX_MULTIPLIER) & MASK_64
+        mixed ^= mixed >> 29
+        return ((mixed * SLOT_MULTIPLIER) & MASK_64) >> self.slot_shift
+
+    def get(self, latitude, longitude):
+        """
+        :param latitude: The latitude, already rounded to the resolution
+        :param longitude: The longitude, already rounded to the resolution
+        :return: The cached elevation or None if it is not cached
+        """
+        key = self.get_key(latitude=latitude, longitude=longitude)
+        keys, values, checks = self.table.array
+        slot = self._get_slot(key)
+        for probe in range(MAX_PROBES):
+            found_key = int(keys[slot])
+            if found_key == 0:
+                return None
+            if found_key == key:
+                value = int(values[slot])
+                if int(checks[slot]) != self._get_check(key, value):
+                    return None
+                return struct.unpack("<d", struct.pack("<Q", value))[0]
+            slot = (slot + 1) & self.slot_mask
+        return None
+
+    def set(self, latitude, longitude, elevation):
+        """
+        :param latitude: The latitude, already rounded to the resolution
+        :param longitude: The longitude, already rounded to the resolution
+        :param elevation: The elevation to cache
+        :return: None
+        """
+        key = self.get_key(latitude=latitude, longitude=longitude)
+        value = struct.unpack("<Q", struct.pack("<d", elevation))[0]
+        check = self._get_check(key, value)
+        keys, values, checks = self.table.array
+        slot = self._get_slot(key)
+        for probe in range(MAX_PROBES):
+            found_key = int(keys[slot])
+            if found_key == 0 or found_key == key:
+                values[slot] = value
+                checks[slot] = check
+                keys[slot] = key
+                return
+            slot = (slot + 1) & self.slot_mask
+        logging.debug(f"Elevation cache is full around ({latitude},{longitude}), not caching.")
+
+    def get_many(self, latitudes, longitudes):
+        """
+        The NumPy version of get.  All the locations are probed together, one probe step at a time.
+        :param latitudes: NumPy array of latitudes, already rounded to the resolution
+        :param longitudes: NumPy array of longitudes, already rounded to the resolution
+        :return: NumPy array of the cached elevations, NaN where an elevation is not cached
+        """
+        keys = self.get_keys(latitudes=latitudes, longitudes=longitudes)
+        slots = self._get_slots(keys)
+        table_keys, table_values, table_checks = self.table.array
+        elevations = np.full(keys.shape, np.nan, dtype=np.float64)
+        pending = np.arange(keys.size)
+        keys = keys.ravel()
+        slots = slots.ravel()
+        flat_elevations = elevations.reshape(-1)
+        for probe in range(MAX_PROBES):
+            if pending.size == 0:
+                break
+            found_keys = table_keys[slots[pending]]
+            hit = found_keys == keys[pending]
+            hits = pending[hit]
+            values = table_values[slots[hits]]
+            valid = table_checks[slots[hits]] == self._get_checks(keys[hits], values)
+            flat_elevations[hits[valid]] = values[valid].view(np.float64)
+            pending = pending[~hit & (found_keys != 0)]
+            slots[pending] = (slots[pending] + 1) & self.slot_mask
+        return elevations
+
+    def set_many(self, latitudes, longitudes, elevations):
+        """
+        The NumPy version of set.
+        :param latitudes: NumPy array of latitudes, already rounded to the resolution
+        :param longitudes: NumPy array of longitudes, already rounded to the resolution
+        :param elevations: NumPy array of the elevations to cache
+        :return: None
+        """
+        keys = self.get_keys(latitudes=latitudes, longitudes=longitudes).ravel()
+        slots = self._get_slots(keys)
+        values = np.ascontiguousarray(elevations, dtype=np.float64).ravel().view(np.uint64)
+        checks = self._get_checks(keys, values)
+        table_keys, table_values, table_checks = self.table.array
+        pending = np.arange(keys.size)
+        for probe in range(MAX_PROBES):
+            if pending.size == 0:
+                return
+            found_keys = table_keys[slots[pending]]
+            free = (found_keys == 0) | (found_keys == keys[pending])
+            writes = pending[free]
+            table_values[slots[writes]] = values[writes]
+            table_checks[slots[writes]] = checks[writes]
+            table_keys[slots[writes]] = keys[writes]
+            # Two keys in this batch can land on the same free slot and only the last write sticks.  The other one
+            # moves on to the next slot with the keys that found theirs taken.
+            written = np.zeros(pending.size, dtype=bool)
+            written[free] = table_keys[slots[writes]] == keys[writes]
+            pending = pending[~written]
+            slots[pending] = (slots[pending] + 1) & self.slot_mask
+        logging.debug(f"Elevation cache is full, not caching {pending.size} elevations.")
@@ -1,8 +1,11 @@
 """elevation_manager.py:
     This defines the ElevationManager that is responsible for managing elevation data from GeoTIFF files and potentially
-    other sources in the future. It uses a multiprocessing safe elevation cache however the GeoTiffs are not shared across
-    processes.  This was both to simplify implementation as well as to allow very large maps to not have all GeoTiffs open
-    at once.  Additionally it means that when the gridding processes die all the geotiffs go with them.
+    other sources in the future. It uses a shared memory elevation cache (see elevation_cache.py) that every process
+    reads and writes directly.  Each tile is decoded once into a .npy file that every process memory-maps, so the
+    processes share the tile data through the OS page cache rather than each reading its own copy.  Each process still
+    opens its own maps, and keeps only tile_cache_bytes of them open at a time, so very large maps don't have every tile
+    open at once, and when the gridding processes die their maps go with them.  The optional mosaic is a single
+    read-only map of the whole area that all the processes share.
     __author__      = "Unintelligible Maker"
     __copyright__   = "Copyright 2024"
     __license__     = "MIT License"
@@ -12,19 +15,43 @@
     __project__     = "PyTerrainModeler"
 """
 
+import hashlib
+import json
 import logging
 import os
 import math
-from geotiff import GeoTiff
-from numpy import array as nparray
-from multiprocessing import Manager
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from .elevation_cache import SLOT_BYTES, SharedElevationCache
+from .elevation_tile import ElevationTile
+from .file_lock import FileLock
+from .tile_cache import TileCache
+
+DEFAULT_CACHE_SIZE = 2 ** 20
+# Degrees.  More than half a pixel of any tile or overview, which is 0.0033 for an 8x overview of a 3 arc second tile.
+AREA_TILE_MARGIN = 0.01
+
+
+class SamplingMode(Enum):
+    NEAREST = 1
+    AREA = 2
 
 
 class ElevationManager(object):
 
     def __init__(self,
                  geotiff_folder=None,
-                 resolution=4):
+                 resolution=4,
+                 cache_size=DEFAULT_CACHE_SIZE,
+                 decoded_tile_folder=None,
+                 tile_cache_bytes=2 ** 30,
+                 sampling_mode=SamplingMode.NEAREST,
+                 cell_size=None,
+                 use_overviews=False,
+                 persistent_cache_folder=None,
+                 hgt_folder=None,
+                 persistent_cache_size=None):
         """
         :param geotiff_folder: The folder where the geotiffs are stored
         :param resolution: The resolution (10 ^ -n) of the elevation data.
@@ -32,13 +59,70 @@ class ElevationManager(object):
                         5 is 0.00001 deg of lat/long which is like 1m or less
                         6 is 0.000001 deg of lat/long which is like 11 cm or less
                         This is all probably more than the GeoTIFFs themselves.
+        :param cache_size: The number of elevations the shared elevation cache should hold.  Usually the number of
+            points in the map grid.  None for no cache in this run, when every point is only looked up once.
+        :param decoded_tile_folder: The folder where decoded tiles are kept as memory-mappable .npy files.
+            Default is a ".decoded" folder inside the geotiff_folder, or the hgt_folder if there is no geotiff_folder.
+            The first time a GeoTIFF (or .hgt.gz file) is used it is decoded
+            and saved here, and every run after that just maps the .npy file.
+        :param tile_cache_bytes: The most bytes of tiles each process keeps open.  The least recently used tiles are
+            closed when a new one would go over this.  None for no limit.
+        :param sampling_mode: How an elevation is taken from the tile.
+            SamplingMode.NEAREST (default) takes the one pixel containing the point.
+            SamplingMode.AREA averages every pixel in the cell_size around the point using a summed-area table.
+        :param cell_size: (latitude, longitude) size in degrees of the cell averaged around each point in
+            SamplingMode.AREA.  Usually the size of a step in the map grid.
+        :param use_overviews: Sample from 2x, 4x or 8x downsampled overviews of the tiles instead of the full
+            resolution ones, picking the coarsest whose pixels are still no bigger than the cell_size.  The overviews
+            are saved in the decoded tile folder next to the decoded tiles.  Meant for draft maps.
+        :param persistent_cache_folder: The folder to keep elevation caches in between runs.  None (default) only
+            caches for this run.  See open_persistent_cache.
+        :param hgt_folder: The folder with the MapZen .hgt or .hgt.gz files, in the same N00 - S90 folders as the
+            geotiffs.  Any tile with no geotiff is read straight from these instead.  Default is the geotiff_folder.
+        :param persistent_cache_size: The number of elevations the persistent elevation cache should hold.  Default is
+            the cache_size, or DEFAULT_CACHE_SIZE if there is no cache for the run.
         """
         self.geotiff_folder = geotiff_folder
+        self.hgt_folder = hgt_folder if hgt_folder is not None else geotiff_folder
+        if decoded_tile_folder is None and self.geotiff_folder is not None:
+            decoded_tile_folder = os.path.join(self.geotiff_folder, ".decoded")
+        elif decoded_tile_folder is None and self.hgt_folder is not None:
+            decoded_tile_folder = os.path.join(self.hgt_folder, ".decoded")
+        self.decoded_tile_folder = decoded_tile_folder
         self.resolution = max(resolution, 4)
+        self.sampling_mode = sampling_mode
+        self.cell_size = cell_size
+        self.use_overviews = use_overviews
+        self.persistent_cache_folder = persistent_cache_folder
+        self.persistent_cache_size = persistent_cache_size or cache_size or DEFAULT_CACHE_SIZE
+        if self.sampling_mode == SamplingMode.AREA and self.cell_size is None:
+            raise ValueError("SamplingMode.AREA needs a cell_size")
+        if self.use_overviews and self.cell_size is None:
+            raise ValueError("use_overviews needs a cell_size")
 
-        self.elevation_cache = Manager().dict()
+        self.elevation_cache = None
+        if cache_size is not None:
+            self.elevation_cache = SharedElevationCache(resolution=self.resolution, capacity=cache_size)
 
-        self.open_geotiffs = {}
+        self.open_geotiffs = TileCache(max_bytes=tile_cache_bytes)
+        self.tile_filenames = {}
+        self.mosaic = None
+
+    def close(self):
+        """
+        Release the shared elevation cache and any open tiles.  Only needed if you want the memory back before the
+        ElevationManager is garbage collected.
+        :return: None
+        """
+        if self.elevation_cache is not None:
+            self.elevation_cache.close()
+        self.open_geotiffs.clear()
+
+    def get_tile_cache_stats(self):
+        """
+        :return: dict of the hit, miss and eviction counters of this process's tile cache.  See TileCache.
+        """
+        return self.open_geotiffs.get_stats()
 
     def _increment_by_resolution(self, initial_value):
         """
@@ -66,6 +150,197 @@ class ElevationManager(object):
         final_value = rounded_initial_value + n_delta
         return round(final_value, self.resolution)
 
+    def get_geotiff_filenames(self, south, west, north, east):
+        """
+        :param south: The southern latitude of the area
+        :param west: The western longitude of the area
+        :param north: The northern latitude of the area
+        :param east: The eastern longitude of the area
+        :return: list of the geotiff filenames for every tile that touches the area.  For a tile with no geotiff this is
+            its .hgt or .hgt.gz file, if there is one.
+        """
+        geotiff_filenames = []
+        for latitude in range(math.floor(south), math.floor(north) + 1):
+            for longitude in range(math.floor(west), math.floor(east) + 1):
+                geotiff_filenames.append(self._get_tile_filename(latitude=latitude + 0.5, longitude=longitude + 0.5))
+        return geotiff_filenames
+
+    def get_tile_sizes(self, south, west, north, east):
+        """
+        The bytes each tile touching the area takes once it is decoded, read from the file headers without decoding
+        anything.  With SamplingMode.AREA that includes the tile's summed-area table.  Overviews are not taken into
+        account, so it's the most the tiles can take.
+        :param south: The southern latitude of the area
+        :param west: The western longitude of the area
+        :param north: The northern latitude of the area
+        :param east: The eastern longitude of the area
+        :return: list of (filename, bytes) for every tile that touches the area.  bytes is None for a tile with no file.
+        """
+        tile_sizes = []
+        for geotiff_filename in self.get_geotiff_filenames(south=south, west=west, north=north, east=east):
+            if not os.path.exists(geotiff_filename):
+                tile_sizes.append((geotiff_filename, None))
+                continue
+            (height, width), dtype = ElevationTile.get_file_shape(geotiff_filename)
+            size = height * width * dtype.itemsize
+            if self.sampling_mode == SamplingMode.AREA:
+                size += (height + 1) * (width + 1) * np.dtype(np.float64).itemsize
+            tile_sizes.append((geotiff_filename, size))
+        return tile_sizes
+
+    def prefetch_tiles(self, south, west, north, east, max_threads=None):
+        """
+        Decode every tile that touches the area into the decoded tile folder before any sampling starts.  The tiles
+        are decoded at the same time in a pool of threads, as the decompression releases the GIL.  After this the
+        gridding processes only ever memory-map tiles and never stall decoding one in the middle of a strip.  The
+        tiles are not kept open in this process.
+        :param south: The southern latitude of the area
+        :param west: The western longitude of the area
+        :param north: The northern latitude of the area
+        :param east: The eastern longitude of the area
+        :param max_threads: The most tiles to decode at once.  Default is one per CPU.
+        :return: None
+        """
+        if self.decoded_tile_folder is None:
+            logging.info(f"No decoded tile folder, so there is nothing to prefetch.")
+            return
+        geotiff_filenames = [geotiff_filename
+                             for geotiff_filename in self.get_geotiff_filenames(south=south, west=west, north=north, east=east)
+                             if os.path.exists(geotiff_filename)]
+        logging.info(f"Prefetching {len(geotiff_filenames)} tiles for ({south},{west}) to ({north},{east})")
+        with ThreadPoolExecutor(max_workers=max_threads or os.cpu_count()) as executor:
+            for tile in executor.map(lambda geotiff_filename: self._load_tile(geotiff_filename=geotiff_filename),
+                                     geotiff_filenames):
+                tile.close()
+
+    def open_persistent_cache(self, south, west, north, east):
+        """
+        Switch the elevation cache over to one kept in a memory-mapped file in the persistent_cache_folder, so a
+        re-run of the same area finds every elevation already there and never touches a tile.  The file is named by a
+        digest of the resolution, the cache's slot layout, the sampling settings and the size and modification time of
+        every tile touching the area, so it is started over automatically when any of those change.  The cache keeps
+        the elevations whole, so a re-run gives exactly the elevations the first run sampled.
+        :param south: The southern latitude of the area
+        :param west: The western longitude of the area
+        :param north: The northern latitude of the area
+        :param east: The eastern longitude of the area
+        :return: None
+        """
+        if self.persistent_cache_folder is None:
+            return
+        description = {"resolution": self.resolution,
+                       "slot_bytes": SLOT_BYTES,
+                       "sampling_mode": self.sampling_mode.name,
+                       "use_overviews": self.use_overviews,
+                       "cell_size": (list(self.cell_size)
+                                     if self.use_overviews or self.sampling_mode == SamplingMode.AREA else None),
+                       "tiles": self._get_tiles_description(south=south, west=west, north=north, east=east)}
+        digest = hashlib.sha1(json.dumps(description).encode()).hexdigest()
+        cache_filename = os.path.join(self.persistent_cache_folder, f"{digest}.elevations")
+        logging.info(f"Using the persistent elevation cache {cache_filename}")
+        persistent_cache = SharedElevationCache(resolution=self.resolution,
+                                                capacity=self.persistent_cache_size,
+                                                filename=cache_filename)
+        if self.elevation_cache is not None:
+            self.elevation_cache.close()
+        self.elevation_cache = persistent_cache
+
+    def _get_tiles_description(self, south, west, north, east):
+        """
+        :param south: The southern latitude of the area
+        :param west: The western longitude of the area
+        :param north: The northern latitude of the area
+        :param east: The eastern longitude of the area
+        :return: list of [filename, size, modification time] of every geotiff touching the area, for building digests
+        """
+        tiles = []
+        for geotiff_filename in self.get_geotiff_filenames(south=south, west=west, north=north, east=east):
+            if os.path.exists(geotiff_filename):
+                tiles.append([geotiff_filename, os.path.getsize(geotiff_filename), os.path.getmtime(geotiff_filename)])
+        return tiles
+
+    def build_mosaic(self, south, west, north, east):
+        """
+        Stitch the tiles that cover the area, plus a one pixel margin, into a single array and use it for all the
+        sampling from here on.  A lookup is then just an index into one array, with no tile filenames or tile cache
+        in the way.  The mosaic is saved in the decoded tile folder and memory-mapped, so the gridding processes all
+        share one read only copy, and a later run over the same area with the same tiles reuses it.
+        :param south: The southern latitude of the area
+        :param west: The western longitude of the area
+        :param north: The northern latitude of the area
+        :param east: The eastern longitude of the area
+        :return: None
+        """
+        if self.decoded_tile_folder is None:
+            logging.warning(f"A mosaic needs a decoded tile folder to share it between processes, not building one.")
+            return
+        mosaic_filename = self._get_mosaic_filename(south=south, west=west, north=north, east=east)
+        mosaic = ElevationTile.load(mosaic_filename) if os.path.exists(mosaic_filename) else None
+        if mosaic is None or (self.sampling_mode == SamplingMode.AREA and mosaic.summed_area_table is None):
+            if mosaic is None:
+                logging.info(f"Building the elevation mosaic for ({south},{west}) to ({north},{east})")
+                mosaic = self._make_mosaic(south=south, west=west, north=north, east=east)
+            if self.sampling_mode == SamplingMode.AREA:
+                mosaic.get_summed_area_table()
+            mosaic.save(mosaic_filename)
+            mosaic = ElevationTile.load(mosaic_filename)
+        self.open_geotiffs.clear()
+        self.mosaic = mosaic
+        logging.info(f"Using the {mosaic.array.shape[0]}x{mosaic.array.shape[1]} elevation mosaic {mosaic_filename}")
+
+    def _make_mosaic(self, south, west, north, east):
+        """
+        The mosaic uses the pixel grid of the tile in the south west corner.  Each mosaic pixel is filled from the tile
+        its center falls in, so tiles on the same grid are copied pixel for pixel.
+        :param south: The southern latitude of the area
+        :param west: The western longitude of the area
+        :param north: The northern latitude of the area
+        :param east: The eastern longitude of the area
+        :return: An ElevationTile covering the area plus a one pixel margin
+        """
+        reference = self._get_tile(latitude=south, longitude=west)
+        first_column = math.floor((west - reference.left) * reference.x_scale) - 1
+        last_column = math.floor((east - reference.left) * reference.x_scale) + 1
+        first_row = math.floor((north - reference.top) * reference.y_scale) - 1
+        last_row = math.floor((south - reference.top) * reference.y_scale) + 1
+        mosaic = ElevationTile(array=np.zeros((last_row - first_row + 1, last_column - first_column + 1),
+                                              dtype=reference.array.dtype),
+                               left=reference.left + (first_column / reference.x_scale),
+                               top=reference.top + (first_row / reference.y_scale),
+                               x_scale=reference.x_scale,
+                               y_scale=reference.y_scale)
+
+        height, width = mosaic.array.shape
+        center_latitudes = mosaic.top + ((np.arange(height) + 0.5) / mosaic.y_scale)
+        center_longitudes = mosaic.left + ((np.arange(width) + 0.5) / mosaic.x_scale)
+        tile_latitudes = np.floor(center_latitudes)
+        tile_longitudes = np.floor(center_longitudes)
+        for tile_latitude in np.unique(tile_latitudes):
+            rows = tile_latitudes == tile_latitude
+            for tile_longitude in np.unique(tile_longitudes):
+                columns = tile_longitudes == tile_longitude
+                tile = self._get_tile(latitude=tile_latitude + 0.5, longitude=tile_longitude + 0.5)
+                latitudes, longitudes = np.meshgrid(center_latitudes[rows], center_longitudes[columns], indexing='ij')
+                elevations = tile.get_elevations(latitudes=latitudes, longitudes=longitudes)
+                mosaic.array[np.ix_(rows, columns)] = elevations.astype(mosaic.array.dtype)
+        return mosaic
+
+    def _get_mosaic_filename(self, south, west, north, east):
+        """
+        :param south: The southern latitude of the area
+        :param west: The western longitude of the area
+        :param north: The northern latitude of the area
+        :param east: The eastern longitude of the area
+        :return: The .npy filename of the mosaic for the area.  The name is a digest of the area, the overview
+            settings and the size and modification time of every tile, so a changed tile makes a new mosaic.
+        """
+        description = {"bounds": [south, west, north, east],
+                       "use_overviews": self.use_overviews,
+                       "cell_size": list(self.cell_size) if self.use_overviews else None,
+                       "tiles": self._get_tiles_description(south=south, west=west, north=north, east=east)}
+        digest = hashlib.sha1(json.dumps(description).encode()).hexdigest()
+        return os.path.join(self.decoded_tile_folder, "mosaics", f"{digest}.npy")
+
     def get_elevation_for_latitude_longitude(self, latitude, longitude):
         """
         :param latitude: The latitude to get the elevation for
@@ -75,49 +350,327 @@ class ElevationManager(object):
         rounded_latitude = round(latitude, self.resolution)
         rounded_longitude = round(longitude, self.resolution)
         logging.debug(f"rounded location: '{rounded_latitude}' & '{rounded_longitude}'")
-        elevation_cache_key = f"({rounded_latitude},{rounded_longitude})"
 
-        if elevation_cache_key in self.elevation_cache:
-            return self.elevation_cache[elevation_cache_key]
+        if self.elevation_cache is not None:
+            elevation = self.elevation_cache.get(latitude=rounded_latitude, longitude=rounded_longitude)
+            if elevation is not None:
+                return elevation
 
         elevation = self._get_elevation_from_geotiff(latitude=rounded_latitude, longitude=rounded_longitude)
         if elevation is not None:
-            self.elevation_cache[elevation_cache_key] = elevation
-            return self.elevation_cache[elevation_cache_key]
+            if self.elevation_cache is not None:
+                self.elevation_cache.set(latitude=rounded_latitude, longitude=rounded_longitude, elevation=elevation)
+            return elevation
 
         raise ValueError("Could not find a value for the elevation")
 
+    def get_elevations(self, latitudes, longitudes):
+        """
+        The NumPy version of get_elevation_for_latitude_longitude.  The points are grouped by GeoTIFF and each group
+        is looked up with a single affine transform and one fancy index into the tile.
+        :param latitudes: Array (or list) of the latitudes to get the elevations for
+        :param longitudes: Array (or list) of the longitudes to get the elevations for, the same shape as latitudes
+        :return: NumPy array of the elevations at the given latitudes and longitudes
+        """
+        rounded_latitudes = np.round(np.asarray(latitudes, dtype=np.float64), self.resolution)
+        rounded_longitudes = np.round(np.asarray(longitudes, dtype=np.float64), self.resolution)
+
+        if self.elevation_cache is None:
+            elevations = np.full(rounded_latitudes.shape, np.nan, dtype=np.float64)
+        else:
+            elevations = self.elevation_cache.get_many(latitudes=rounded_latitudes, longitudes=rounded_longitudes)
+        missing = np.isnan(elevations)
+        if missing.any():
+            missing_latitudes = rounded_latitudes[missing]
+            missing_longitudes = rounded_longitudes[missing]
+            missing_elevations = self._get_elevations_from_geotiffs(latitudes=missing_latitudes,
+                                                                    longitudes=missing_longitudes)
+            if self.elevation_cache is not None:
+                self.elevation_cache.set_many(latitudes=missing_latitudes,
+                                              longitudes=missing_longitudes,
+                                              elevations=missing_elevations)
+            elevations[missing] = missing_elevations
+        logging.debug(f"Elevations: {elevations.size} points, {np.count_nonzero(missing)} from GeoTiffs")
+        return elevations
+
+    def _get_elevations_from_geotiffs(self, latitudes, longitudes):
+        """
+        :param latitudes: NumPy array of latitudes, already rounded to the resolution
+        :param longitudes: NumPy array of longitudes, already rounded to the resolution
+        :return: NumPy array of the elevations at the given latitudes and longitudes
+        """
+        if self.mosaic is not None:
+            return self._sample_tile(tile=self.mosaic, latitudes=latitudes, longitudes=longitudes)
+        if self.sampling_mode == SamplingMode.AREA:
+            return self._get_area_elevations_from_geotiffs(latitudes=latitudes, longitudes=longitudes)
+
+        elevations = np.empty(latitudes.shape, dtype=np.float64)
+        tile_ids = np.floor(latitudes).astype(np.int64) * 360 + np.floor(longitudes).astype(np.int64)
+        for tile_id in np.unique(tile_ids):
+            in_tile = tile_ids == tile_id
+            tile_latitudes = latitudes[in_tile]
+            tile_longitudes = longitudes[in_tile]
+            tile = self._get_tile(latitude=tile_latitudes[0], longitude=tile_longitudes[0])
+            elevations[in_tile] = self._sample_tile(tile=tile, latitudes=tile_latitudes, longitudes=tile_longitudes)
+        return elevations
+
+    def _get_area_elevations_from_geotiffs(self, latitudes, longitudes):
+        """
+        The SamplingMode.AREA version of _get_elevations_from_geotiffs.  A cell near the edge of a tile runs into its
+        neighbors, so every cell is summed over each tile it touches (up to four), each tile counting only the pixels
+        in its own 1 degree square, and the sums are averaged together.  The tiles within AREA_TILE_MARGIN of a cell
+        are checked, and the ones the cell turns out not to touch add nothing.  That is what the mosaic gives, so the tile
+        edges don't show.  A neighbor with no file is left out, and a cell smaller than a pixel that ends up with no
+        pixels at all takes the pixel under it.
+        :param latitudes: NumPy array of latitudes, already rounded to the resolution
+        :param longitudes: NumPy array of longitudes, already rounded to the resolution
+        :return: NumPy array of the elevations at the given latitudes and longitudes
+        """
+        cell_latitude, cell_longitude = self.cell_size
+        # The edge pixels of a tile reach half a pixel past its square, so a cell that stops just short of the next
+        # tile can still take some of that tile's pixels.
+        half_latitude = (abs(cell_latitude) / 2) + AREA_TILE_MARGIN
+        half_longitude = (abs(cell_longitude) / 2) + AREA_TILE_MARGIN
+        own_tile_ids = self._get_tile_ids(latitudes=latitudes, longitudes=longitudes)
+        totals = np.zeros(latitudes.shape, dtype=np.float64)
+        counts = np.zeros(latitudes.shape, dtype=np.int64)
+        # Every (tile, location) pair, from the tiles under the corners of each cell.
+        tile_ids = np.concatenate([self._get_tile_ids(latitudes=latitudes + latitude_offset,
+                                                      longitudes=longitudes + longitude_offset)
+                                   for latitude_offset in (-half_latitude, half_latitude)
+                                   for longitude_offset in (-half_longitude, half_longitude)])
+        pairs = np.unique(np.stack([tile_ids, np.tile(np.arange(latitudes.size), 4)]), axis=1)
+        for tile_id in np.unique(pairs[0]):
+            in_tile = pairs[1][pairs[0] == tile_id]
+            tile_latitude, tile_longitude = divmod(int(tile_id), 360)
+            tile_latitude -= 90
+            tile_longitude -= 180
+            if not np.any(own_tile_ids[in_tile] == tile_id) and not os.path.exists(
+                    self._get_tile_filename(latitude=tile_latitude + 0.5, longitude=tile_longitude + 0.5)):
+                continue
+            tile = self._get_tile(latitude=tile_latitude + 0.5, longitude=tile_longitude + 0.5)
+            total, count = tile.get_area_sums(latitudes=latitudes[in_tile], longitudes=longitudes[in_tile],
+                                              cell_latitude=cell_latitude, cell_longitude=cell_longitude,
+                                              bounds=(tile_latitude, tile_longitude,
+                                                      tile_latitude + 1, tile_longitude + 1))
+            totals[in_tile] += total
+            counts[in_tile] += count
+
+        elevations = np.empty(latitudes.shape, dtype=np.float64)
+        sampled = counts > 0
+        elevations[sampled] = totals[sampled] / counts[sampled]
+        for point_index in np.flatnonzero(~sampled):
+            tile = self._get_tile(latitude=latitudes[point_index], longitude=longitudes[point_index])
+            elevations[point_index] = tile.get_elevation(latitude=float(latitudes[point_index]),
+                                                         longitude=float(longitudes[point_index]))
+        return elevations
+
+    @staticmethod
+    def _get_tile_ids(latitudes, longitudes):
+        """
+        :param latitudes: NumPy array of latitudes
+        :param longitudes: NumPy array of longitudes
+        :return: NumPy array of a number for the 1 degree tile each location is in, (latitude + 90) * 360 +
+            (longitude + 180) of its south west corner
+        """
+        return ((np.floor(latitudes).astype(np.int64) + 90) * 360) + (np.floor(longitudes).astype(np.int64) + 180)
+
+    def _sample_tile(self, tile, latitudes, longitudes):
+        """
+        :param tile: The ElevationTile the locations are in
+        :param latitudes: NumPy array of latitudes
+        :param longitudes: NumPy array of longitudes
+        :return: NumPy array of the elevations, sampled according to the sampling_mode
+        """
+        if self.sampling_mode == SamplingMode.AREA:
+            cell_latitude, cell_longitude = self.cell_size
+            return tile.get_area_elevations(latitudes=latitudes, longitudes=longitudes,
+                                            cell_latitude=cell_latitude, cell_longitude=cell_longitude)
+        return tile.get_elevations(latitudes=latitudes, longitudes=longitudes)
+
+    def _get_tile(self, latitude, longitude):
+        """
+        :param latitude: A latitude inside the tile
+        :param longitude: A longitude inside the tile
+        :return: The ElevationTile for the GeoTIFF that contains the given latitude and longitude
+        """
+        geotiff_filename = self._get_tile_filename(latitude=latitude, longitude=longitude)
+        tile = self.open_geotiffs.get(geotiff_filename)
+        if tile is None:
+            logging.debug(f"Elevation GeoTiff for ({latitude},{longitude}) is not loaded.  Loading file {geotiff_filename}")
+            tile = self._load_tile(geotiff_filename=geotiff_filename)
+            if self.use_overviews:
+                tile = self._get_overview_tile(geotiff_filename=geotiff_filename, tile=tile)
+            if self.sampling_mode == SamplingMode.AREA:
+                # Build it now so the tile cache counts it.
+                tile.get_summed_area_table()
+            self.open_geotiffs.put(geotiff_filename, tile)
+        return tile
+
+    def _load_tile(self, geotiff_filename):
+        """
+        :param geotiff_filename: The GeoTIFF (or .hgt or .hgt.gz file) to load
+        :return: The ElevationTile for the GeoTIFF.  Memory-mapped from the decoded tile folder when possible.  An .hgt
+            file is already raw data, so it is memory-mapped where it is.
+        """
+        if self.decoded_tile_folder is None or geotiff_filename.lower().endswith(".hgt"):
+            return ElevationTile.from_file(geotiff_filename)
+
+        decoded_filename = self._get_decoded_filename(geotiff_filename=geotiff_filename)
+        if self._is_decoded_file_current(decoded_filename=decoded_filename, geotiff_filename=geotiff_filename):
+            return ElevationTile.load(decoded_filename)
+
+        # Only one process decodes a tile.  Any others that need it wait here and then load the one it saved.
+        with FileLock(os.path.splitext(decoded_filename)[0] + ".lock"):
+            if self._is_decoded_file_current(decoded_filename=decoded_filename, geotiff_filename=geotiff_filename):
+                return ElevationTile.load(decoded_filename)
+            logging.info(f"Decoding {geotiff_filename}")
+            tile = ElevationTile.from_file(geotiff_filename)
+            try:
+                tile.save(decoded_filename)
+            except OSError as e:
+                logging.warning(f"Could not save decoded tile {decoded_filename}, using it from memory: {e}")
+                return tile
+            return ElevationTile.load(decoded_filename)
+
+    def _get_overview_tile(self, geotiff_filename, tile):
+        """
+        :param geotiff_filename: The GeoTIFF filename
+        :param tile: The full resolution ElevationTile for the GeoTIFF
+        :return: The overview of the tile that matches the cell_size.  Overviews are loaded from the decoded tile
+            folder, or built a level at a time from the one before and saved there.
+        """
+        cell_latitude, cell_longitude = self.cell_size
+        level = tile.get_overview_level(cell_latitude=cell_latitude, cell_longitude=cell_longitude)
+        if level == 0:
+            return tile
+
+        overview = tile
+        for overview_level in range(1, level + 1):
+            if self.decoded_tile_folder is None:
+                next_overview = overview.get_overview()
+            else:
+                overview_filename = self._get_decoded_filename(geotiff_filename=geotiff_filename,
+                                                               overview_level=overview_level)
+                if self._is_decoded_file_current(decoded_filename=overview_filename, geotiff_filename=geotiff_filename):
+                    next_overview = ElevationTile.load(overview_filename)
+                else:
+                    next_overview = self._build_overview(geotiff_filename=geotiff_filename,
+                                                         overview_filename=overview_filename,
+                                                         overview=overview)
+            overview.close()
+            overview = next_overview
+        logging.debug(f"Using the {2 ** level}x overview of {geotiff_filename}")
+        return overview
+
+    def _build_overview(self, geotiff_filename, overview_filename, overview):
+        """
+        Build the next overview and save it in the decoded tile folder, under the same kind of per-file lock as
+        _load_tile, so when several gridding processes need it at once only one builds it.  ElevationTile.save writes
+        each file to a temporary file and renames it, so nobody reads half an overview.
+        :param geotiff_filename: The GeoTIFF filename
+        :param overview_filename: The .npy file of the overview, from _get_decoded_filename
+        :param overview: The ElevationTile (the tile or an overview) to build the next overview from
+        :return: The ElevationTile of the next overview.  Memory-mapped from the saved file when possible.
+        """
+        with FileLock(os.path.splitext(overview_filename)[0] + ".lock"):
+            if self._is_decoded_file_current(decoded_filename=overview_filename, geotiff_filename=geotiff_filename):
+                return ElevationTile.load(overview_filename)
+            next_overview = overview.get_overview()
+            try:
+                next_overview.save(overview_filename)
+            except OSError as e:
+                logging.warning(f"Could not save overview {overview_filename}, using it from memory: {e}")
+                return next_overview
+            return ElevationTile.load(overview_filename)
+
+    @staticmethod
+    def _is_decoded_file_current(decoded_filename, geotiff_filename):
+        """
+        :param decoded_filename: The .npy file in the decoded tile folder
+        :param geotiff_filename: The GeoTIFF it was decoded from
+        :return: True if the decoded file exists and is at least as new as the GeoTIFF
+        """
+        return (os.path.exists(decoded_filename)
+                and os.path.getmtime(decoded_filename) >= os.path.getmtime(geotiff_filename))
+
+    def _get_decoded_filename(self, geotiff_filename, overview_level=0):
+        """
+        :param geotiff_filename: The GeoTIFF (or .hgt or .hgt.gz file) filename
+        :param overview_level: 0 for the full resolution tile, or the overview level (1 is 2x, 2 is 4x, 3 is 8x)
+        :return: The .npy filename of the decoded copy of the GeoTIFF.  A tile decodes to the same name whatever
+            kind of file it came from.
+        """
+        latitude_folder, basename = os.path.split(geotiff_filename)
+        relative_filename = os.path.join(os.path.basename(latitude_folder), basename.split(".")[0])
+        if overview_level:
+            relative_filename = f"{relative_filename}.{2 ** overview_level}x"
+        return os.path.join(self.decoded_tile_folder, relative_filename + ".npy")
+
     def _get_elevation_from_geotiff(self, latitude, longitude):
         """
         :param latitude: The latitude to get the elevation for
         :param longitude: The longitude to get the elevation for
         :return: The elevation at the given latitude and longitude
         """
-        geotiff_filename = self._get_geotiff_filename(latitude=latitude, longitude=longitude)
-        if geotiff_filename not in self.open_geotiffs:
-            geotiff_file = geotiff_filename
-            logging.debug(f"Elevation GeoTiff for ({latitude},{longitude}) is not loaded.  Loading file {geotiff_file}")
-            geotiff = GeoTiff(geotiff_file, 0)
-            zarr_array = geotiff.read()
-            array = nparray(zarr_array)
-            self.open_geotiffs.update({geotiff_filename: (geotiff, array)})
+        if self.sampling_mode == SamplingMode.AREA:
+            elevation = float(self._get_elevations_from_geotiffs(latitudes=np.array([latitude], dtype=np.float64),
+                                                                 longitudes=np.array([longitude], dtype=np.float64))[0])
         else:
-            geotiff, array = self.open_geotiffs.get(geotiff_filename)
-        x = geotiff._get_x_int(float(longitude))
-        y = geotiff._get_y_int(float(latitude))
-        elevation = float(array[y][x])
+            tile = self.mosaic if self.mosaic is not None else self._get_tile(latitude=latitude, longitude=longitude)
+            elevation = tile.get_elevation(latitude=float(latitude), longitude=float(longitude))
         if elevation is not None:
             logging.debug(f"Elevation GeoTiff Hit: ({latitude},{longitude}) = {elevation}m")
         else:
             logging.debug(f"Elevation GeoTiff Miss: ({latitude},{longitude})")
         return elevation
 
+    def _get_tile_filename(self, latitude, longitude):
+        """
+        :param latitude: A latitude inside the tile
+        :param longitude: A longitude inside the tile
+        :return: The file to read the tile from: the geotiff if there is one, otherwise the .hgt or .hgt.gz file in the
+            hgt_folder.  If there is none of them this is the geotiff filename (or the .hgt filename with no
+            geotiff_folder), so the error names the usual file.
+        """
+        tile_key = (math.floor(latitude), math.floor(longitude))
+        tile_filename = self.tile_filenames.get(tile_key)
+        if tile_filename is None:
+            candidates = []
+            if self.geotiff_folder is not None:
+                candidates.append(self._get_geotiff_filename(latitude=latitude, longitude=longitude))
+            if self.hgt_folder is not None:
+                hgt_filename = os.path.join(self.hgt_folder,
+                                            self._get_tile_name(latitude=latitude, longitude=longitude) + ".hgt")
+                candidates += [hgt_filename, hgt_filename + ".gz"]
+            for candidate in candidates:
+                if os.path.exists(candidate):
+                    tile_filename = candidate
+                    break
+            if tile_filename is None and candidates:
+                tile_filename = candidates[0]
+            self.tile_filenames[tile_key] = tile_filename
+        return tile_filename
+
     def _get_geotiff_filename(self, latitude, longitude):
         """
         :param latitude: The latitude to get the geotiff filename for
         :param longitude: The longitude  to get the geotiff filename for
         :return: The geotiff filename for the given latitude and longitude
         """
+        geotiff_filename = os.path.join(self.geotiff_folder,
+                                        self._get_tile_name(latitude=latitude, longitude=longitude) + ".tiff")
+        logging.debug(f"Geotiff Filename: {geotiff_filename}")
+        return geotiff_filename
+
+    @staticmethod
+    def _get_tile_name(latitude, longitude):
+        """
+        :param latitude: A latitude inside the tile
+        :param longitude: A longitude inside the tile
+        :return: The tile's latitude folder and name without an extension, like N46/N46W122.  The geotiffs and the
+            MapZen files are laid out the same way.
+        """
         if latitude < 0.0:
             latitude_component = f"S{format(abs(math.floor(latitude)), '02d')}"
         else:
@@ -128,6 +681,4 @@ class ElevationManager(object):
         else:
             longitude_component = f"E{format(math.floor(longitude), '03d')}"
 
-        geotiff_filename = os.path.join(self.geotiff_folder, latitude_component, f"{latitude_component}{longitude_component}.tiff")
-        logging.debug(f"Geotiff Filename: {geotiff_filename}")
-        return geotiff_filename
+        return os.path.join(latitude_component, f"{latitude_component}{longitude_component}")
@@ -0,0 +1,442 @@
+"""elevation_tile.py:
+    This defines the ElevationTile, one block of elevation data along with the affine transform from latitude and
+    longitude to pixels in that block.  The ElevationManager loads them from the GeoTIFFs and then does all of its
+    lookups through them, either one point at a time or a whole NumPy array of points at once.  Lookups either take the
+    one pixel containing the point or, through a summed-area table, the average of all the pixels in a cell around it.
+    A tile can also make overviews of itself at half the resolution for draft maps that don't need every pixel.
+
+    A tile can be saved as a raw .npy file, with its transform in a .json file next to it, and loaded back
+    memory-mapped.  Decoding a DEFLATE GeoTIFF is slow, so the ElevationManager does this once per tile and every
+    process after that shares the same pages through the OS page cache.  A memory-mapped tile pickles as just its
+    filename, so it can be handed to the gridding processes without copying the data.
+
+    A tile can also be read straight from the MapZen (SRTM) .hgt files, with no GDAL conversion at all.  An .hgt file
+    is nothing but a square grid of big-endian int16 with the tile's corner in its name, so it is memory-mapped as is.
+    An .hgt.gz file is decompressed a block at a time straight into the tile's array.
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import struct
+import tempfile
+import numpy as np
+import tifffile
+from geotiff import GeoTiff
+
+HGT_NAME_PATTERN = re.compile(r"([NS])(\d{2})([EW])(\d{3})\.hgt(\.gz)?$", re.IGNORECASE)
+HGT_DTYPE = np.dtype(">i2")
+
+
+class ElevationTile(object):
+
+    def __init__(self, array, left, top, x_scale, y_scale):
+        """
+        :param array: The elevation data as a 2D array indexed [y][x] with y = 0 at the top (north)
+        :param left: The longitude of the left (west) edge of the data
+        :param top: The latitude of the top (north) edge of the data
+        :param x_scale: Pixels per degree of longitude
+        :param y_scale: Pixels per degree of latitude.  Negative as y counts down from the top.
+        """
+        self.array = array
+        self.left = left
+        self.top = top
+        self.x_scale = x_scale
+        self.y_scale = y_scale
+        self.summed_area_table = None
+        self.filename = None
+
+    def __getstate__(self):
+        if self.filename is not None:
+            return {"filename": self.filename}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if "array" in state:
+            self.__dict__.update(state)
+        else:
+            self.__dict__.update(ElevationTile.load(state["filename"]).__dict__)
+
+    @staticmethod
+    def from_geotiff(geotiff_filename):
+        """
+        :param geotiff_filename: The GeoTIFF to load
+        :return: An ElevationTile with the data and transform of the GeoTIFF
+        """
+        logging.debug(f"Loading GeoTIFF {geotiff_filename}")
+        geotiff = GeoTiff(geotiff_filename, 0)
+        array = np.array(geotiff.read())
+        (left, top), (right, bottom) = geotiff.tif_bBox
+        height, width = geotiff.tif_shape
+        return ElevationTile(array=array,
+                             left=left,
+                             top=top,
+                             x_scale=float(width / (right - left)),
+                             y_scale=float(height / (bottom - top)))
+
+    @staticmethod
+    def from_file(filename):
+        """
+        :param filename: A GeoTIFF, .hgt or .hgt.gz file
+        :return: An ElevationTile with the data and transform of the file
+        """
+        if HGT_NAME_PATTERN.search(os.path.basename(filename)):
+            return ElevationTile.from_hgt(filename)
+        return ElevationTile.from_geotiff(filename)
+
+    @staticmethod
+    def from_hgt(hgt_filename):
+        """
+        The samples in an .hgt file are on the lines of latitude and longitude (pixel is point) and the first row is
+        the north edge, so the tile's pixels run half a pixel past the whole degree on every side.  This is the same
+        transform GDAL gives the GeoTIFF it converts the file to, so either file samples the same.
+        :param hgt_filename: The .hgt or .hgt.gz file to load.  The name (like N46W122.hgt) gives its south west corner.
+        :return: An ElevationTile with the data of the file.  Memory-mapped read only for an .hgt file.
+        """
+        logging.debug(f"Loading HGT {hgt_filename}")
+        match = HGT_NAME_PATTERN.search(os.path.basename(hgt_filename))
+        if match is None:
+            raise ValueError(f"{hgt_filename} is not named like an HGT tile, e.g. N46W122.hgt")
+        latitude = int(match.group(2)) * (1 if match.group(1).upper() == "N" else -1)
+        longitude = int(match.group(4)) * (1 if match.group(3).upper() == "E" else -1)
+
+        if match.group(5):
+            size = ElevationTile._get_gzip_size(hgt_filename)
+            samples = ElevationTile._get_hgt_samples(hgt_filename, size)
+            array = np.empty((samples, samples), dtype=HGT_DTYPE)
+            buffer = memoryview(array.reshape(-1).view(np.uint8))
+            read = 0
+            with gzip.open(hgt_filename, "rb") as f:
+                while read < size:
+                    count = f.readinto(buffer[read:])
+                    if not count:
+                        raise ValueError(f"{hgt_filename} is shorter than its gzip trailer says")
+                    read += count
+            array = array.astype(np.int16)
+        else:
+            samples = ElevationTile._get_hgt_samples(hgt_filename, os.path.getsize(hgt_filename))
+            array = np.memmap(hgt_filename, dtype=HGT_DTYPE, mode='r', shape=(samples, samples))
+
+        pixels_per_degree = samples - 1
+        return ElevationTile(array=array,
+                             left=longitude - (0.5 / pixels_per_degree),
+                             top=latitude + 1 + (0.5 / pixels_per_degree),
+                             x_scale=float(pixels_per_degree),
+                             y_scale=float(-pixels_per_degree))
+
+    @staticmethod
+    def get_file_shape(filename):
+        """
+        Only the GeoTIFF header, or the size of the .hgt file, is read.  Nothing is decoded.
+        :param filename: A GeoTIFF, .hgt or .hgt.gz file
+        :return: ((height, width), dtype) of the elevations in the file
+        """
+        match = HGT_NAME_PATTERN.search(os.path.basename(filename))
+        if match:
+            size = ElevationTile._get_gzip_size(filename) if match.group(5) else os.path.getsize(filename)
+            samples = ElevationTile._get_hgt_samples(filename, size)
+            return (samples, samples), np.dtype(np.int16)
+        with tifffile.TiffFile(filename) as tif:
+            page = tif.pages[0]
+            return tuple(page.shape[:2]), np.dtype(page.dtype)
+
+    @staticmethod
+    def _get_gzip_size(gzip_filename):
+        """
+        :param gzip_filename: A gzip file
+        :return: The size of its uncompressed data in bytes, from the last four bytes of the file.  That is only mod
+            2^32, which is plenty for a tile.
+        """
+        with open(gzip_filename, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack("<I", f.read(4))[0]
+
+    @staticmethod
+    def _get_hgt_samples(hgt_filename, size):
+        """
+        :param hgt_filename: The .hgt or .hgt.gz file, for the error message
+        :param size: The size of the uncompressed data in bytes
+        :return: The number of samples on each side of the tile (1201 for 3 arc second data, 3601 for 1 arc second)
+        """
+        samples = math.isqrt(size // HGT_DTYPE.itemsize)
+        if samples < 2 or samples * samples * HGT_DTYPE.itemsize != size:
+            raise ValueError(f"{hgt_filename} is {size} bytes, which is not a square grid of int16")
+        return samples
+
+    @staticmethod
+    def load(npy_filename):
+        """
+        :param npy_filename: The .npy file written by save
+        :return: An ElevationTile with the data, and the summed-area table if one was saved, memory-mapped read only
+        """
+        logging.debug(f"Loading decoded tile {npy_filename}")
+        with open(ElevationTile._get_transform_filename(npy_filename)) as f:
+            transform = json.load(f)
+        tile = ElevationTile(array=np.load(npy_filename, mmap_mode='r'),
+                             left=transform["left"],
+                             top=transform["top"],
+                             x_scale=transform["x_scale"],
+                             y_scale=transform["y_scale"])
+        summed_area_table_filename = ElevationTile._get_summed_area_table_filename(npy_filename)
+        if os.path.exists(summed_area_table_filename):
+            tile.summed_area_table = np.load(summed_area_table_filename, mmap_mode='r')
+        tile.filename = npy_filename
+        return tile
+
+    def save(self, npy_filename):
+        """
+        Save the tile as a raw .npy file in its native dtype (int16 for the MapZen data) plus a .json file with the
+        transform.  If the summed-area table has been built it is saved too, as a .sat.npy file.  Everything is
+        written to a temporary file and renamed, so a process reading the tile at the same time never sees half a file.
+        :param npy_filename: The .npy file to write
+        :return: None
+        """
+        folder = os.path.dirname(npy_filename)
+        os.makedirs(folder, exist_ok=True)
+        transform = {"left": self.left,
+                     "top": self.top,
+                     "x_scale": self.x_scale,
+                     "y_scale": self.y_scale}
+        ElevationTile._write_atomically(ElevationTile._get_transform_filename(npy_filename),
+                                        lambda f: f.write(json.dumps(transform).encode()))
+        summed_area_table_filename = ElevationTile._get_summed_area_table_filename(npy_filename)
+        if self.summed_area_table is not None:
+            ElevationTile._write_atomically(summed_area_table_filename,
+                                            lambda f: np.save(f, self.summed_area_table))
+        elif os.path.exists(summed_area_table_filename):
+            os.remove(summed_area_table_filename)
+        ElevationTile._write_atomically(npy_filename,
+                                        lambda f: np.save(f, np.ascontiguousarray(self.array)))
+        logging.debug(f"Saved decoded tile {npy_filename}")
+
+    @staticmethod
+    def _get_transform_filename(npy_filename):
+        """
+        :param npy_filename: The .npy file of the tile
+        :return: The .json file holding the transform for the tile
+        """
+        return os.path.splitext(npy_filename)[0] + ".json"
+
+    @staticmethod
+    def _get_summed_area_table_filename(npy_filename):
+        """
+        :param npy_filename: The .npy file of the tile
+        :return: The .sat.npy file holding the summed-area table for the tile
+        """
+        return os.path.splitext(npy_filename)[0] + ".sat.npy"
+
+    @staticmethod
+    def _write_atomically(filename, write):
+        """
+        :param filename: The file to write
+        :param write: Function that writes the content to the open binary file it is given
+        :return: None
+        """
+        file_descriptor, temporary_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as f:
+                write(f)
+            os.replace(temporary_filename, filename)
+        except BaseException:
+            os.remove(temporary_filename)
+            raise
+
+    def get_x_int(self, longitude):
+        """
+        :param longitude: The longitude to get the pixel column for
+        :return: The pixel column
+        """
+        return int(self.x_scale * (longitude - self.left))
+
+    def get_y_int(self, latitude):
+        """
+        :param latitude: The latitude to get the pixel row for
+        :return: The pixel row
+        """
+        return int(self.y_scale * (latitude - self.top))
+
+    def get_elevation(self, latitude, longitude):
+        """
+        :param latitude: The latitude to get the elevation for
+        :param longitude: The longitude to get the elevation for
+        :return: The elevation of the pixel containing the location
+        """
+        return float(self.array[self.get_y_int(latitude)][self.get_x_int(longitude)])
+
+    def get_size(self):
+        """
+        :return: The number of bytes of data the tile holds
+        """
+        if self.array is None:
+            return 0
+        if self.summed_area_table is None:
+            return self.array.nbytes
+        return self.array.nbytes + self.summed_area_table.nbytes
+
+    def close(self):
+        """
+        Drop the tile's data.  A memory-mapped file is unmapped once nothing else refers to it.
+        :return: None
+        """
+        self.array = None
+        self.summed_area_table = None
+
+    def get_elevations(self, latitudes, longitudes):
+        """
+        :param latitudes: NumPy array of latitudes, all inside this tile
+        :param longitudes: NumPy array of longitudes, the same shape as latitudes
+        :return: NumPy array of the elevations of the pixels containing each location
+        """
+        height, width = self.array.shape
+        x = np.clip((self.x_scale * (longitudes - self.left)).astype(np.int64), 0, width - 1)
+        y = np.clip((self.y_scale * (latitudes - self.top)).astype(np.int64), 0, height - 1)
+        return self.array[y, x].astype(np.float64)
+
+    def get_overview_level(self, cell_latitude, cell_longitude, max_level=3):
+        """
+        :param cell_latitude: The height of a grid cell in degrees of latitude
+        :param cell_longitude: The width of a grid cell in degrees of longitude
+        :param max_level: The coarsest overview level to allow
+        :return: The coarsest overview level (each level halves the resolution) whose pixels are still no bigger than
+            a grid cell.  0 means use the tile itself.
+        """
+        pixels_per_cell = min(abs(cell_longitude * self.x_scale), abs(cell_latitude * self.y_scale))
+        level = 0
+        while level < max_level and 2 ** (level + 1) <= pixels_per_cell:
+            level += 1
+        return level
+
+    def get_overview(self):
+        """
+        Each overview pixel is the average of a 2x2 block of pixels, rounded back to the tile's dtype.  An odd last row
+        or column is averaged with a copy of itself.
+        :return: A new ElevationTile at half the resolution covering the same area
+        """
+        height, width = self.array.shape
+        padded = np.pad(self.array, ((0, height % 2), (0, width % 2)), mode='edge')
+        blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+        overview = blocks.mean(axis=(1, 3), dtype=np.float64)
+        if np.issubdtype(self.array.dtype, np.integer):
+            overview = np.rint(overview)
+        return ElevationTile(array=overview.astype(self.array.dtype),
+                             left=self.left,
+                             top=self.top,
+                             x_scale=self.x_scale / 2,
+                             y_scale=self.y_scale / 2)
+
+    def get_summed_area_table(self):
+        """
+        The summed-area table is one larger than the array in each direction, with a row and column of zeros first,
+        so table[y][x] is the sum of array[:y, :x].  It is built the first time it is needed.
+        :return: The summed-area table of the tile
+        """
+        if self.summed_area_table is None:
+            height, width = self.array.shape
+            logging.debug(f"Building {height}x{width} summed-area table")
+            summed_area_table = np.zeros((height + 1, width + 1), dtype=np.float64)
+            np.cumsum(np.cumsum(self.array, axis=0, dtype=np.float64), axis=1, out=summed_area_table[1:, 1:])
+            self.summed_area_table = summed_area_table
+        return self.summed_area_table
+
+    def get_area_elevations(self, latitudes, longitudes, cell_latitude, cell_longitude):
+        """
+        Average every pixel that touches a cell centered on each location.  Each average is four lookups in the
+        summed-area table no matter how many pixels the cell covers.  A cell that runs off the edge of the tile only
+        averages the part inside the tile.
+        :param latitudes: NumPy array of latitudes, all inside this tile
+        :param longitudes: NumPy array of longitudes, the same shape as latitudes
+        :param cell_latitude: The height of the cell in degrees of latitude
+        :param cell_longitude: The width of the cell in degrees of longitude
+        :return: NumPy array of the average elevation of the cell around each location
+        """
+        total, count = self.get_area_sums(latitudes=latitudes, longitudes=longitudes,
+                                          cell_latitude=cell_latitude, cell_longitude=cell_longitude)
+        return total / count
+
+    def get_area_sums(self, latitudes, longitudes, cell_latitude, cell_longitude, bounds=None):
+        """
+        The sum and number of the pixels that touch a cell centered on each location, so cells that cross into other
+        tiles can be averaged over all of them.  See get_area_elevations.
+        :param latitudes: NumPy array of latitudes
+        :param longitudes: NumPy array of longitudes, the same shape as latitudes
+        :param cell_latitude: The height of the cell in degrees of latitude
+        :param cell_longitude: The width of the cell in degrees of longitude
+        :param bounds: (south, west, north, east) of the part of the tile to use.  Only the pixels whose centers are in
+            it count, so two tiles that share their edge pixels (like the MapZen ones) don't both count them.  A
+            center right on an edge goes with the north or east side.  Default is None, which uses the whole tile and
+            counts a cell that runs off the tile as the part inside it.
+        :return: (total, count) NumPy arrays of the sum of the elevations and the number of pixels in each cell.  Both
+            are 0 for a cell that misses the bounds.
+        """
+        summed_area_table = self.get_summed_area_table()
+        height, width = self.array.shape
+        if bounds is None:
+            x_pixels = (0, width - 1)
+            y_pixels = (0, height - 1)
+        else:
+            south, west, north, east = bounds
+            x_pixels = self._get_pixels_between(west, east, self.left, self.x_scale, width)
+            y_pixels = self._get_pixels_between(south, north, self.top, self.y_scale, height)
+        x_first, x_last, x_touched = self._get_pixel_range(
+            self.x_scale * (longitudes - (cell_longitude / 2) - self.left),
+            self.x_scale * (longitudes + (cell_longitude / 2) - self.left),
+            *x_pixels)
+        y_first, y_last, y_touched = self._get_pixel_range(
+            self.y_scale * (latitudes - (cell_latitude / 2) - self.top),
+            self.y_scale * (latitudes + (cell_latitude / 2) - self.top),
+            *y_pixels)
+        total = (summed_area_table[y_last + 1, x_last + 1]
+                 - summed_area_table[y_first, x_last + 1]
+                 - summed_area_table[y_last + 1, x_first]
+                 + summed_area_table[y_first, x_first])
+        count = (y_last - y_first + 1) * (x_last - x_first + 1)
+        if bounds is not None:
+            touched = x_touched & y_touched & (x_pixels[0] <= x_pixels[1]) & (y_pixels[0] <= y_pixels[1])
+            total = np.where(touched, total, 0.0)
+            count = np.where(touched, count, 0)
+        return total, count
+
+    @staticmethod
+    def _get_pixels_between(low, high, origin, scale, size):
+        """
+        :param low: The southern or western edge, in degrees
+        :param high: The northern or eastern edge, in degrees
+        :param origin: The top or left of the tile
+        :param scale: The y_scale or x_scale of the tile
+        :param size: The number of pixels in this direction
+        :return: The first and last pixel whose center is from low up to (not including) high.  A hundredth of a pixel
+            is allowed either way, so a center right on an edge always goes with the same side.
+        """
+        shift = 0.01 / abs(scale)
+        low_edge = scale * (low - shift - origin) - 0.5
+        high_edge = scale * (high - shift - origin) - 0.5
+        if scale > 0:
+            first, last = math.ceil(low_edge), math.ceil(high_edge) - 1
+        else:
+            first, last = math.floor(high_edge) + 1, math.floor(low_edge)
+        return max(first, 0), min(last, size - 1)
+
+    @staticmethod
+    def _get_pixel_range(edge_a, edge_b, first_pixel, last_pixel):
+        """
+        :param edge_a: NumPy array of one edge of the cells in (fractional) pixels
+        :param edge_b: NumPy array of the other edge of the cells in (fractional) pixels
+        :param first_pixel: The first pixel that can be used
+        :param last_pixel: The last pixel that can be used
+        :return: (first, last, touched) The first and last pixel touched by each cell, clipped to first_pixel and
+            last_pixel, and whether each cell touches any of the pixels between them at all
+        """
+        first = np.floor(np.minimum(edge_a, edge_b)).astype(np.int64)
+        last = np.floor(np.maximum(edge_a, edge_b)).astype(np.int64)
+        touched = (last >= first_pixel) & (first <= last_pixel)
+        return np.clip(first, first_pixel, last_pixel), np.clip(last, first_pixel, last_pixel), touched
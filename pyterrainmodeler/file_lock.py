@@ -0,0 +1,55 @@
+"""file_lock.py:
+    This defines the FileLock, an exclusive lock on a lock file held with fcntl.flock.  The ElevationManager takes one
+    per tile while it decodes the tile, so when several gridding processes need the same new tile at once only the
+    first one decodes it and the others wait and then load what it saved.  The lock goes away with the process if it
+    dies, so a crashed run never leaves a tile locked.  On systems without fcntl (Windows) it does nothing, and the
+    worst case is the tile being decoded more than once.
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock(object):
+
+    def __init__(self, filename):
+        """
+        :param filename: The lock file.  It is created if needed and left in place afterwards.
+        """
+        self.filename = filename
+        self.file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            self.file = open(self.filename, "a")
+        except OSError as e:
+            logging.warning(f"Could not open lock {self.filename}, going on without it: {e}")
+            return self
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.debug(f"Waiting for lock {self.filename}")
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        return False
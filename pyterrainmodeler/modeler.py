@@ -13,7 +13,8 @@
         normalize the vector, and perform cross product calculations.
 
     Modeler is a class that manages the model creation process, including loading model grid data, creating triangles,
-        and exporting the model to an STL file.
+        and exporting the model to an STL file.  It can also make the triangles of whole strips of the model at once
+        with NumPy, straight from the z heights, as blocks ready for the StlWriter.
 
     __author__      = "Unintelligible Maker"
     __copyright__   = "Copyright 2024"
@@ -27,9 +28,16 @@
 import logging
 from math import sqrt
 from multiprocessing import Pool
+import numpy as np
 from numpy import array as nparray
 from numpy.random import normal
-from stl.mesh import Mesh
+from .stl_writer import STL_DTYPE
+
+try:
+    from stl.mesh import Mesh
+except ImportError:
+    # Only generate_mesh needs numpy-stl.  The StlWriter doesn't.
+    Mesh = None
 
 
 class ModelPoint(object):
@@ -120,7 +128,7 @@ class Vector(object):
 
 
 class Modeler(object):
-    def __init__(self, size_x, size_y, steps_x, steps_y, model_points):
+    def __init__(self, size_x, size_y, steps_x, steps_y, model_points=None):
         """
         :param size_x: The size of the model along the x-axis (unitless but usually mm for 3d printing)
         :param size_y: The size of the model along the y-axis (unitless but usually mm for 3d printing)
@@ -129,6 +137,7 @@ class Modeler(object):
         :param model_points: A list of lists of ModelPoint objects representing the model grid points
             so model_points[y_step][x_step] is the point at the given x_step and y_step steps from the
             origin.  The ModelPoint contained there has the x,y,z model info in unitless distance 
+            Not needed for get_side_faces and get_strip_faces.
         """""
         self.model_points = model_points
 
@@ -146,6 +155,13 @@ class Modeler(object):
         self.y_step_size = size_y / steps_y
         logging.debug(f"y_step_size: {self.y_step_size}")
 
+        self.xs = np.array([Modeler.get_model_x_y_for_steps(size_x=size_x, size_y=size_y, x_step=x_step, y_step=0,
+                                                            steps_x=steps_x, steps_y=steps_y)[0]
+                            for x_step in range(0, steps_x + 1)])
+        self.ys = np.array([Modeler.get_model_x_y_for_steps(size_x=size_x, size_y=size_y, x_step=0, y_step=y_step,
+                                                            steps_x=steps_x, steps_y=steps_y)[1]
+                            for y_step in range(0, steps_y + 1)])
+
     def get_model_x_y_for_steps(self, x_step, y_step):
         """
         :param x_step: The step along the x-axis
@@ -171,13 +187,21 @@ class Modeler(object):
         y = round((y_step * size_y / steps_y), 3)
         return x, y
 
-    def generate_triangles(self, max_processes=1):
+    def generate_triangles(self, max_processes=1, indexes=None):
         """
-        :param max_processes: The maximum number of processes to use for triangle generation
+        :param max_processes: The maximum number of processes to use for triangle generation.  1 does it in this
+            process, so it can run inside a Pool worker.
+        :param indexes: The strips along the x-axis to make triangles for, where -1 is the sides of the model.  Default
+            is all of them, sides first.  Only the model_points the strips use have to be there.
         :return: None
         """
+        if indexes is None:
+            indexes = range(-1, self.steps_x)
+        if max_processes == 1:
+            self.triangles = [self._generate_triangles_for_(index) for index in indexes]
+            return
         with Pool(max_processes) as p:
-            self.triangles = p.map(self._generate_triangles_for_, range(-1, self.steps_x))
+            self.triangles = p.map(self._generate_triangles_for_, indexes)
 
     def save_stl(self, filename):
         """
@@ -356,14 +380,174 @@ class Modeler(object):
                 triangles.append(triangle_left_2)
         return triangles
 
+    def get_strip_faces(self, x_step, z_grid):
+        """
+        The NumPy version of _generate_triangles_for_top_and_bottom_strip_x for a block of strips.  The triangles are
+        picked, ordered and floored exactly the same way, with the same float math, so the faces are the same.
+
+        :param x_step: The x step of the first row of z_grid
+        :param z_grid: NumPy array of the z heights of the rows from x_step on, indexed [x_step][y_step].  The strips
+            between each pair of rows are done, so one less strip than rows.
+        :return: NumPy array of STL_DTYPE faces, without normals
+        """
+        rows = len(z_grid)
+        points = np.empty((rows, self.steps_y + 1, 3))
+        points[:, :, 0] = self.xs[x_step:x_step + rows, np.newaxis]
+        points[:, :, 1] = self.ys[np.newaxis, :]
+        points[:, :, 2] = z_grid
+        corner = points[:-1, :-1]
+        next_x = points[1:, :-1]
+        next_x_y = points[1:, 1:]
+        next_y = points[:-1, 1:]
+
+        triangle_a_1 = (corner, next_x, next_x_y)
+        triangle_a_2 = (corner, next_x_y, next_y)
+        triangle_b_1 = (corner, next_x, next_y)
+        triangle_b_2 = (next_x, next_x_y, next_y)
+        cos_theta_a = Modeler._dot_products(Modeler._get_normals(*triangle_a_1), Modeler._get_normals(*triangle_a_2))
+        cos_theta_b = Modeler._dot_products(Modeler._get_normals(*triangle_b_1), Modeler._get_normals(*triangle_b_2))
+        use_a = (np.abs(cos_theta_a) < np.abs(cos_theta_b))[:, :, np.newaxis]
+
+        # Each square is up to 4 faces: triangle 1, its floor copy, triangle 2 and its floor copy.
+        vectors = np.empty((rows - 1, self.steps_y, 4, 3, 3))
+        keep = np.empty((rows - 1, self.steps_y, 4), dtype=bool)
+        for slot, (triangle_a, triangle_b) in enumerate(((triangle_a_1, triangle_b_1), (triangle_a_2, triangle_b_2))):
+            a, b, c = [np.where(use_a, point_a, point_b) for point_a, point_b in zip(triangle_a, triangle_b)]
+            vectors[:, :, 2 * slot] = np.stack((a, b, c), axis=2)
+            vectors[:, :, 2 * slot + 1] = np.stack((a, c, b), axis=2)
+            vectors[:, :, 2 * slot + 1, :, 2] = 0
+            on_floor = (a[:, :, 2] == 0) & (b[:, :, 2] == 0) & (c[:, :, 2] == 0)
+            keep[:, :, 2 * slot] = ~on_floor
+            keep[:, :, 2 * slot + 1] = ~on_floor
+        return Modeler._get_faces(vectors[keep])
+
+    def get_side_faces(self, front_z, rear_z, left_z, right_z):
+        """
+        The NumPy version of _generate_triangles_for_front_and_rear and _generate_triangles_for_left_and_right, in the
+        same order.
+
+        :param front_z: NumPy array of the z heights along y step 0, by x step
+        :param rear_z: NumPy array of the z heights along the last y step, by x step
+        :param left_z: NumPy array of the z heights along x step 0, by y step
+        :param right_z: NumPy array of the z heights along the last x step, by y step
+        :return: NumPy array of STL_DTYPE faces, without normals
+        """
+        front_rear = np.empty((self.steps_x, 4, 3, 3))
+        front_rear_keep = np.empty((self.steps_x, 4), dtype=bool)
+        front = Modeler._get_line_points(xs=self.xs, ys=self.ys[0], zs=front_z)
+        rear = Modeler._get_line_points(xs=self.xs, ys=self.ys[-1], zs=rear_z)
+        front_rear[:, 0] = Modeler._stack_vertices(Modeler._floor(front[:-1]), front[:-1], Modeler._floor(front[1:]))
+        front_rear_keep[:, 0] = front_z[:-1] != 0
+        front_rear[:, 1] = Modeler._stack_vertices(front[:-1], front[1:], Modeler._floor(front[1:]))
+        front_rear_keep[:, 1] = front_z[1:] != 0
+        front_rear[:, 2] = Modeler._stack_vertices(rear[:-1], Modeler._floor(rear[:-1]), Modeler._floor(rear[1:]))
+        front_rear_keep[:, 2] = rear_z[:-1] != 0
+        front_rear[:, 3] = Modeler._stack_vertices(rear[:-1], Modeler._floor(rear[1:]), rear[1:])
+        front_rear_keep[:, 3] = rear_z[1:] != 0
+
+        left_right = np.empty((self.steps_y, 4, 3, 3))
+        left_right_keep = np.empty((self.steps_y, 4), dtype=bool)
+        left = Modeler._get_line_points(xs=self.xs[0], ys=self.ys, zs=left_z)
+        right = Modeler._get_line_points(xs=self.xs[-1], ys=self.ys, zs=right_z)
+        left_right[:, 0] = Modeler._stack_vertices(Modeler._floor(right[:-1]), right[:-1], Modeler._floor(right[1:]))
+        left_right_keep[:, 0] = right_z[:-1] != 0
+        left_right[:, 1] = Modeler._stack_vertices(right[:-1], right[1:], Modeler._floor(right[1:]))
+        left_right_keep[:, 1] = right_z[1:] != 0
+        left_right[:, 2] = Modeler._stack_vertices(left[:-1], Modeler._floor(left[:-1]), Modeler._floor(left[1:]))
+        left_right_keep[:, 2] = left_z[:-1] != 0
+        left_right[:, 3] = Modeler._stack_vertices(left[:-1], Modeler._floor(left[1:]), left[1:])
+        # _generate_triangles_for_left_and_right checks the same point for both left triangles.
+        left_right_keep[:, 3] = left_z[:-1] != 0
+        return Modeler._get_faces(np.concatenate((front_rear[front_rear_keep], left_right[left_right_keep])))
+
+    @staticmethod
+    def _get_line_points(xs, ys, zs):
+        """
+        :param xs: The x of each point, or one x for all of them
+        :param ys: The y of each point, or one y for all of them
+        :param zs: NumPy array of the z of each point
+        :return: NumPy array of the points, shape (len(zs), 3)
+        """
+        points = np.empty((len(zs), 3))
+        points[:, 0] = xs
+        points[:, 1] = ys
+        points[:, 2] = zs
+        return points
+
+    @staticmethod
+    def _floor(points):
+        """
+        :param points: NumPy array of points, with x, y, z on the last axis
+        :return: A copy of the points at z 0, like ModelPoint.get_floor_copy
+        """
+        points = points.copy()
+        points[..., 2] = 0
+        return points
+
+    @staticmethod
+    def _stack_vertices(a, b, c):
+        """
+        :param a: NumPy array of the first points of the triangles
+        :param b: NumPy array of the second points
+        :param c: NumPy array of the third points
+        :return: NumPy array of the triangles, with the 3 points on the second to last axis
+        """
+        return np.stack((a, b, c), axis=-2)
+
+    @staticmethod
+    def _get_normals(a, b, c):
+        """
+        Triangle.get_normal for arrays of triangles, done in the same order so it rounds the same.
+
+        :param a: NumPy array of the first points of the triangles, with x, y, z on the last axis
+        :param b: NumPy array of the second points
+        :param c: NumPy array of the third points
+        :return: (x, y, z) NumPy arrays of the unit normals, 0 for triangles with no area
+        """
+        v1_x, v1_y, v1_z = a[..., 0] - b[..., 0], a[..., 1] - b[..., 1], a[..., 2] - b[..., 2]
+        v2_x, v2_y, v2_z = a[..., 0] - c[..., 0], a[..., 1] - c[..., 1], a[..., 2] - c[..., 2]
+        c_x = v1_y * v2_z - v1_z * v2_y
+        c_y = v1_z * v2_x - v1_x * v2_z
+        c_z = v1_x * v2_y - v1_y * v2_x
+        magnitudes = np.sqrt((c_x * c_x) + (c_y * c_y) + (c_z * c_z))
+        flat = magnitudes == 0
+        magnitudes[flat] = 1
+        normals = (c_x / magnitudes, c_y / magnitudes, c_z / magnitudes)
+        for normal in normals:
+            normal[flat] = 0
+        return normals
+
+    @staticmethod
+    def _dot_products(n1, n2):
+        """
+        :param n1: (x, y, z) NumPy arrays of vectors
+        :param n2: (x, y, z) NumPy arrays of vectors
+        :return: NumPy array of the dot products, like Vector.dot_product
+        """
+        return (n1[0] * n2[0]) + (n1[1] * n2[1]) + (n1[2] * n2[2])
+
+    @staticmethod
+    def _get_faces(vectors):
+        """
+        :param vectors: NumPy array of triangles, shape (triangles, 3, 3)
+        :return: NumPy array of STL_DTYPE faces with the vectors, normals left 0
+        """
+        faces = np.zeros(len(vectors), dtype=STL_DTYPE)
+        faces["vectors"] = vectors
+        return faces
+
     def generate_faces(self, max_processes=1):
         """
-        :param max_processes: The maximum number of processes to use for face generation
+        :param max_processes: The maximum number of processes to use for face generation.  1 does it in this
+            process.
         :return: None
         """
         logging.info(f"Generating faces")
-        with Pool(max_processes) as p:
-            faces_groups = p.map(self._generate_faces, self.triangles)
+        if max_processes == 1:
+            faces_groups = [self._generate_faces(triangles) for triangles in self.triangles]
+        else:
+            with Pool(max_processes) as p:
+                faces_groups = p.map(self._generate_faces, self.triangles)
         self.faces = []
         for faces in faces_groups:
             self.faces.extend(faces)
@@ -386,6 +570,8 @@ class Modeler(object):
         """
         if len(self.faces) == 0:
             self.generate_faces()
+        if Mesh is None:
+            raise ImportError("generate_mesh needs numpy-stl.  TerrainModeler.save_stl writes STL files without it.")
         logging.info(f"Meshing.")
         array = nparray(self.faces, dtype=Mesh.dtype)
         self.mesh = Mesh(array)
@@ -0,0 +1,124 @@
+"""shared_array.py:
+    This defines the SharedArray, a thin wrapper around a NumPy array that lives in multiprocessing.shared_memory.
+    The process that creates it owns the memory and unlinks it when it is closed or garbage collected.  When it is
+    pickled (for example as part of a Pool task) only the name, shape and dtype are sent, and the receiving process
+    attaches to the same memory.  This means the gridding processes can all read and write the same array with no
+    server process and no copying.
+
+    It also defines the MappedArray, which does the same thing with a memory-mapped file instead, so the array is
+    still there for the next run.
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+import logging
+import os
+import tempfile
+import weakref
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SharedArray(object):
+
+    def __init__(self, shape, dtype):
+        """
+        :param shape: The shape of the array
+        :param dtype: The NumPy dtype of the array.  The array starts out zero filled.
+        """
+        self.shape = tuple(int(dimension) for dimension in shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=size)
+        self.owner = True
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shared_memory.buf)
+        self.array.fill(0)
+        self._finalizer = weakref.finalize(self, SharedArray._release, self.shared_memory, True)
+        logging.debug(f"Created shared array {self.shared_memory.name}: {self.shape} {self.dtype}")
+
+    def __getstate__(self):
+        return {"name": self.shared_memory.name,
+                "shape": self.shape,
+                "dtype": self.dtype.str}
+
+    def __setstate__(self, state):
+        self.shape = state["shape"]
+        self.dtype = np.dtype(state["dtype"])
+        self.shared_memory = shared_memory.SharedMemory(name=state["name"])
+        self.owner = False
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shared_memory.buf)
+        self._finalizer = weakref.finalize(self, SharedArray._release, self.shared_memory, False)
+
+    def close(self):
+        """
+        Release this process's view of the array.  If this process created the array it is also unlinked.
+        :return: None
+        """
+        self.array = None
+        self._finalizer()
+
+    @staticmethod
+    def _release(memory, unlink):
+        """
+        :param memory: The SharedMemory to release
+        :param unlink: If the shared memory should be removed from the system as well
+        :return: None
+        """
+        try:
+            memory.close()
+        except BufferError:
+            # Somebody still holds a view of the buffer.  The mapping goes away with the process.
+            logging.debug(f"Shared array {memory.name} still has views, leaving it mapped.")
+        if unlink:
+            try:
+                memory.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class MappedArray(object):
+
+    def __init__(self, filename, shape, dtype):
+        """
+        :param filename: The file backing the array.  If it is missing, or is not the right size for the shape and
+            dtype, a new zero filled one is made.
+        :param shape: The shape of the array
+        :param dtype: The NumPy dtype of the array
+        """
+        self.filename = filename
+        self.shape = tuple(int(dimension) for dimension in shape)
+        self.dtype = np.dtype(dtype)
+        size = int(np.prod(self.shape)) * self.dtype.itemsize
+        if not os.path.exists(filename) or os.path.getsize(filename) != size:
+            logging.debug(f"Creating mapped array {filename}: {self.shape} {self.dtype}")
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            file_descriptor, temporary_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+            with os.fdopen(file_descriptor, "wb") as f:
+                f.truncate(size)
+            os.replace(temporary_filename, filename)
+        self.array = np.memmap(filename, dtype=self.dtype, mode="r+", shape=self.shape)
+
+    def __getstate__(self):
+        return {"filename": self.filename,
+                "shape": self.shape,
+                "dtype": self.dtype.str}
+
+    def __setstate__(self, state):
+        self.filename = state["filename"]
+        self.shape = state["shape"]
+        self.dtype = np.dtype(state["dtype"])
+        self.array = np.memmap(self.filename, dtype=self.dtype, mode="r+", shape=self.shape)
+
+    def close(self):
+        """
+        Flush the array to its file and release this process's view of it.
+        :return: None
+        """
+        if self.array is not None:
+            self.array.flush()
+            self.array = None
@@ -0,0 +1,80 @@
+"""stl_writer.py:
+    This defines the StlWriter, which writes a binary STL file a block of triangles at a time, so a model never has to
+    be in memory all at once.  A binary STL starts with an 80 byte header and the number of triangles, which isn't
+    known until the end, so room is left for them and they are filled in when the writer is closed.  The triangles are
+    written exactly like numpy-stl's Mesh.save writes them, and the header is the same format, so a model written a
+    block at a time is the same file as one saved in one go (apart from the time in the header).  numpy-stl itself
+    isn't needed.  If it is installed, its name and version go in the header like it would put them.
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+import datetime
+import logging
+import os
+import struct
+import numpy as np
+
+try:
+    from stl import __about__ as numpy_stl
+except ImportError:
+    numpy_stl = None
+
+HEADER_SIZE = 80
+HEADER_FORMAT = "{package_name} ({version}) {now} {name}"
+# The same layout as numpy-stl's Mesh.dtype, which is the binary STL triangle record.
+STL_DTYPE = np.dtype([("normals", "<f4", (3,)),
+                      ("vectors", "<f4", (3, 3)),
+                      ("attr", "<u2", (1,))])
+
+
+class StlWriter(object):
+
+    def __init__(self, filename):
+        """
+        :param filename: The STL file to write
+        """
+        self.filename = filename
+        self.triangle_count = 0
+        self.file = open(filename, "wb")
+        self.file.write(bytes(HEADER_SIZE + 4))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        """
+        :param data: NumPy array of triangles with the STL_DTYPE (or numpy-stl Mesh.dtype).  The normals are filled in
+            from the vectors, unnormalized, as Mesh.save does.
+        :return: None
+        """
+        vectors = data["vectors"]
+        data["normals"] = np.cross(vectors[:, 1] - vectors[:, 0], vectors[:, 2] - vectors[:, 0])
+        data.tofile(self.file)
+        self.triangle_count += len(data)
+
+    def close(self):
+        """
+        Fill in the header and the triangle count, and close the file.
+        :return: None
+        """
+        if self.file is None:
+            return
+        header = HEADER_FORMAT.format(package_name=numpy_stl.__package_name__ if numpy_stl else "PyTerrainModeler",
+                                      version=numpy_stl.__version__ if numpy_stl else "1.0",
+                                      now=datetime.datetime.now(),
+                                      name=os.path.split(self.filename)[-1])
+        self.file.seek(0)
+        self.file.write(header[:HEADER_SIZE].ljust(HEADER_SIZE, " ").encode("ascii", "replace"))
+        self.file.write(struct.pack("<I", self.triangle_count))
+        self.file.close()
+        self.file = None
+        logging.info(f"Wrote {self.triangle_count} triangles to {self.filename}")
@@ -13,14 +13,33 @@
     __project__     = "PyTerrainModeler"
 """
 
+import copy
 import logging
 import os
 import math
+import tempfile
+import time
+import numpy as np
 from geopy import Point, distance
 from enum import Enum
-from .elevation_manager import ElevationManager
-from .modeler import Modeler, ModelPoint
-from multiprocessing import Manager, Pool
+from .bathymetry import DepthUnit, Soundings
+from .elevation_manager import ElevationManager, SamplingMode
+from .geodesy import GridMode, get_distances, get_grid
+from .modeler import Modeler
+from .shared_array import MappedArray, SharedArray
+from .stl_writer import HEADER_SIZE, STL_DTYPE, StlWriter
+from multiprocessing import Pool
+
+SOUNDINGS_BLOCK = 2 ** 18
+STRIP_BLOCK_POINTS = 2 ** 16
+# Measured peak bytes of temporaries, for plan(): per grid point of a strip being sampled, per sounding of a block
+# being assigned and per grid point of a block of strips being triangulated and written.
+SAMPLING_BYTES_PER_POINT = 220
+SOUNDING_BYTES = 700
+TRIANGULATION_BYTES_PER_POINT = 900
+CALIBRATION_STRIPS = 4
+Z_SETTINGS = ("scale_z", "offset_elevation", "min_allowed_z", "flatten_reference_elevation_meters", "flatten_factor",
+              "flatten_mode")
 
 
 class FlattenMode(Enum):
@@ -29,11 +48,6 @@ class FlattenMode(Enum):
     NEGATIVE = 3
 
 
-class XYZFileTypes(Enum):
-    TYPE_A = 1
-    TYPE_B = 2
-
-
 class TerrainModeler:
     def __init__(self,
                  latitude,
@@ -50,6 +64,15 @@ class TerrainModeler:
                  flatten_factor=1,
                  flatten_mode=None,
                  geotiff_folder=None,
+                 hgt_folder=None,
+                 decoded_tile_folder=None,
+                 tile_cache_bytes=2 ** 30,
+                 sampling_mode=SamplingMode.NEAREST,
+                 use_overviews=False,
+                 use_mosaic=False,
+                 persistent_cache_folder=None,
+                 grid_mode=GridMode.GEODESIC,
+                 band_steps=None,
                  xyz_config=None,
                  max_processes=(os.cpu_count() * 2)):
         """
@@ -70,10 +93,32 @@ class TerrainModeler:
         :param flatten_factor: flatten factor Te logrythmic factor to flatten by.  0.7 - 0.98 ish
         :param flatten_mode: flatten mode - Can be None, FlattenMode.POSITIVE (above the referance), FlattenMode.NEGATIVE (below the referance) or FlattenMode.BOTH.
         :param geotiff_folder: geotiff folder The folder where the geotiffs are stored.  See README.
+        :param hgt_folder: The folder with the MapZen .hgt or .hgt.gz files.  Tiles with no geotiff are read straight
+                from these, so the conversion to geotiff is optional.  Default is the geotiff_folder.  See README.
+        :param decoded_tile_folder: The folder to keep decoded, memory-mappable copies of the geotiffs in.
+                Default is geotiff_folder/.decoded, or hgt_folder/.decoded with no geotiff_folder.  See README.
+        :param tile_cache_bytes: The most bytes of elevation tiles each process keeps open.  Default is 1GB.
+        :param sampling_mode: SamplingMode.NEAREST (default) uses the one geotiff pixel at each grid point.
+                SamplingMode.AREA averages all the geotiff pixels in the grid cell around each point, which is
+                smoother when the steps are much bigger than the geotiff pixels.
+        :param use_overviews: Sample from 2x, 4x or 8x downsampled copies of the geotiffs, the coarsest that still has
+                a pixel per step.  Much quicker for drafts of big maps.
+        :param use_mosaic: Stitch the geotiffs under the map into one array before sampling.  Quicker for maps that
+                cross geotiff boundaries.  Needs the decoded_tile_folder.
+        :param persistent_cache_folder: Folder to keep the sampled elevations and parsed xyz files in between runs.
+                Re-running the same map (say while tuning scale_z or the flatten options) then skips the geotiffs
+                completely and memory-maps the soundings instead of reading the xyz text again.  Without it nothing
+                is cached, as a run only samples each grid point once.
+        :param grid_mode: GridMode.GEODESIC (default) places the grid points along geodesics on the WGS-84 ellipsoid.
+                GridMode.TANGENT_PLANE treats the map as flat, which is close enough for small maps.  See geodesy.py.
+        :param band_steps: For models too big to fit in memory.  The sampled elevations are kept in a file (in the
+                decoded_tile_folder, or the temp folder) instead of memory, and the STL is written this many x steps at
+                a time.  Default is None, which keeps them in memory.
         :param xyz_config: xyz config = The XYZ Config for NOOA XYZ files.
                 {surface elevation: [file, file, file, ... ],
-                 surface elevation: [file, file, file, ... ]
+                 surface elevation: [file, (file, DepthUnit.METERS), file, ... ]
                  ...}
+                A file is in feet unless it is given as a (file, DepthUnit) pair.
         :param max_processes: max processes The maxiumim number of processes to have running at a time.
         """
         self.longitude_delta = longitude_size / steps_x
@@ -128,36 +173,323 @@ class TerrainModeler:
 
         self.max_processes = max_processes
         logging.debug(f"max_processes: {self.max_processes}")
+
+        self.use_mosaic = use_mosaic
+        logging.debug(f"use_mosaic: {self.use_mosaic}")
+
+        self.grid_mode = grid_mode
+        logging.debug(f"grid_mode: {self.grid_mode}")
+
+        self.band_steps = band_steps
+        logging.debug(f"band_steps: {self.band_steps}")
         map_farpoint = distance.distance(meters=y_meters).destination(distance.distance(meters=x_meters).destination(self.map_origin, bearing=90), bearing=0)
 
         self.latitude_delta = (map_farpoint.latitude - self.map_origin.latitude) / steps_y
         logging.debug(f"{longitude_size}/{steps_x} = {self.longitude_delta}")
 
         self.elevation_manager = ElevationManager(geotiff_folder=geotiff_folder,
-                                                  resolution=-order_of_magnitude)
-        self.z_cache = Manager().dict()
+                                                  hgt_folder=hgt_folder,
+                                                  resolution=-order_of_magnitude,
+                                                  cache_size=None,
+                                                  persistent_cache_size=(steps_x + 1) * (steps_y + 1),
+                                                  decoded_tile_folder=decoded_tile_folder,
+                                                  tile_cache_bytes=tile_cache_bytes,
+                                                  sampling_mode=sampling_mode,
+                                                  cell_size=(self.latitude_delta, self.longitude_delta),
+                                                  use_overviews=use_overviews,
+                                                  persistent_cache_folder=persistent_cache_folder)
+        self.persistent_cache_folder = persistent_cache_folder
+        self.map_grid = None
         self.modeler = None
 
     def save_stl(self, filename):
-        grid = self._build_grid()
+        grid_filename = None
+        if self.band_steps:
+            folder = self.elevation_manager.decoded_tile_folder or tempfile.gettempdir()
+            file_descriptor, grid_filename = tempfile.mkstemp(dir=folder, suffix=".grid")
+            os.close(file_descriptor)
+        try:
+            self._sample_grid(grid_filename=grid_filename)
+            latitudes, longitudes, elevations = self.map_grid.array
+            self._save_model(elevations=elevations, filename=filename)
+            del latitudes, longitudes, elevations
+        finally:
+            if self.map_grid is not None:
+                self.map_grid.close()
+                self.map_grid = None
+            if grid_filename is not None:
+                os.remove(grid_filename)
+
+    def save_stls(self, variants):
+        """
+        Save several models of the same map that only differ in how elevations become z heights, like a run of
+        scale_z or flatten_factor values to compare.  The elevations are sampled (and the xyz files applied) once,
+        then the variants are triangulated and saved in parallel, one per process.
+
+        :param variants: list of (filename, settings).  settings is a dict of any of scale_z, offset_elevation,
+                min_allowed_z, flatten_reference_elevation_meters, flatten_factor and flatten_mode.  Anything left
+                out is what this TerrainModeler has.
+                e.g. [("rainier_1.5.stl", {"scale_z": 1.5}), ("rainier_2.stl", {"scale_z": 2})]
+        :return: None
+        """
+        for filename, settings in variants:
+            unknown_settings = set(settings) - set(Z_SETTINGS)
+            if unknown_settings:
+                raise ValueError(f"{filename}: {sorted(unknown_settings)} can't change between variants.  "
+                                 f"Only {', '.join(Z_SETTINGS)} can.")
+        self._sample_grid()
+        try:
+            if self.max_processes == 1 or len(variants) == 1:
+                for variant in variants:
+                    self._save_variant(variant=variant)
+            else:
+                with Pool(min(len(variants), self.max_processes)) as p:
+                    p.map(self._save_variant, variants)
+        finally:
+            self.map_grid.close()
+            self.map_grid = None
+
+    def save_stl_progressively(self, filename, drafts):
+        """
+        Save coarse drafts of the map on the way to the full model, without sampling anything twice.  When the draft
+        steps divide the full steps, every draft grid point is also a full grid point, so each level only samples the
+        points the levels before it didn't have, and the full model costs no more than it would on its own.  It comes
+        out exactly the same as save_stl too.  With SamplingMode.AREA the drafts are sampled with the full model's
+        cells, so they look rougher than a model made at their steps.
+
+        :param filename: The filename to save the full STL file to
+        :param drafts: list of (steps_x, steps_y, filename), coarsest first.  Each steps_x and steps_y has to divide
+                this TerrainModeler's.  A filename of None samples the level without saving it, to get its points done
+                early.
+                e.g. [(100, 100, "rainier_draft.stl"), (500, 500, "rainier_better.stl")] on the way to 1000x1000
+        :return: None
+        """
+        levels = list(drafts) + [(self.steps_x, self.steps_y, filename)]
+        for steps_x, steps_y, level_filename in levels:
+            if self.steps_x % steps_x or self.steps_y % steps_y:
+                raise ValueError(f"Draft steps {steps_x}x{steps_y} don't divide the model steps "
+                                 f"{self.steps_x}x{self.steps_y}.")
+        self._open_elevations()
+        soundings = self._load_soundings() if self.xyz_config else None
+        self.map_grid = SharedArray(shape=(3, self.steps_x + 1, self.steps_y + 1), dtype=np.float64)
+        sampled = np.zeros((self.steps_x + 1, self.steps_y + 1), dtype=bool)
+        try:
+            for steps_x, steps_y, level_filename in levels:
+                stride_x = self.steps_x // steps_x
+                stride_y = self.steps_y // steps_y
+                y_steps = np.arange(0, self.steps_y + 1, stride_y)
+                lines = []
+                for x_step in range(0, self.steps_x + 1, stride_x):
+                    new_y_steps = y_steps[~sampled[x_step, y_steps]]
+                    if len(new_y_steps):
+                        lines.append((x_step, new_y_steps))
+                logging.info(f"Sampling {sum(len(new_y_steps) for x_step, new_y_steps in lines)} new points for "
+                             f"{steps_x}x{steps_y}")
+                with Pool(self.max_processes) as p:
+                    p.starmap(self._build_map_line, lines)
+                sampled[::stride_x, ::stride_y] = True
+                if level_filename is None:
+                    continue
+
+                level = self._get_level(steps_x=steps_x, steps_y=steps_y)
+                latitudes, longitudes, elevations = self.map_grid.array[:, ::stride_x, ::stride_y]
+                elevations = elevations.copy()
+                if soundings:
+                    level._apply_soundings(soundings=soundings,
+                                           latitudes=latitudes,
+                                           longitudes=longitudes,
+                                           elevations=elevations)
+                level._save_model(elevations=elevations, filename=level_filename)
+                del latitudes, longitudes, elevations
+        finally:
+            self.map_grid.close()
+            self.map_grid = None
+
+    def plan(self, calibrate=False):
+        """
+        Work out what save_stl will take for this map without sampling any of it: the tiles it reads, the size of the
+        grid and the model, and about how much memory each stage peaks at, all the processes together.  The memory
+        is worked out from the array sizes plus the measured temporaries of each stage, so it is a guide, not a
+        promise.
+
+        :param calibrate: Also sample a few strips of the map and triangulate a block of them in this process, and
+                estimate how long each stage takes from that.  This opens the tiles (decoding them the first time) and
+                caches the elevations it samples, so it isn't free.  Default is False.
+        :return: dict of the plan, ready for json.dumps.  The bytes are all in bytes.
+        """
+        south, west, north, east = self._get_map_bounds()
+        tile_sizes = self.elevation_manager.get_tile_sizes(south=south, west=west, north=north, east=east)
+        tile_bytes = sum(size for filename, size in tile_sizes if size is not None)
+        grid_points = (self.steps_x + 1) * (self.steps_y + 1)
+        # Each square is two top triangles and their floor copies, and each edge step two wall triangles.
+        max_triangles = (4 * self.steps_x * self.steps_y) + (4 * self.steps_x) + (4 * self.steps_y)
+        processes = min(self.max_processes, self.steps_x + 1)
+
+        grid_bytes = 3 * grid_points * np.dtype(np.float64).itemsize
+        memory_grid_bytes = 0 if self.band_steps else grid_bytes
+        if self.use_mosaic:
+            # The mosaic is one read only map all the processes share.
+            open_tile_bytes = tile_bytes
+        else:
+            max_tile_bytes = self.elevation_manager.open_geotiffs.max_bytes
+            largest_tile_bytes = max([size for filename, size in tile_sizes if size is not None], default=0)
+            open_tile_bytes = processes * (tile_bytes if max_tile_bytes is None
+                                           else min(tile_bytes, max(max_tile_bytes, largest_tile_bytes)))
+        memory_bytes = {"sampling": (memory_grid_bytes
+                                     + open_tile_bytes
+                                     + (processes * (self.steps_y + 1) * SAMPLING_BYTES_PER_POINT))}
+
+        sounding_counts = []
+        if self.xyz_config:
+            sounding_counts = [Soundings.count_xyz(xyz_filename=xyz_file,
+                                                   depth_unit=depth_unit,
+                                                   cache_folder=self.persistent_cache_folder)
+                               for surface_elevation, xyz_file, depth_unit in self._get_xyz_files()]
+            # The soundings, the best depth, distance and surface and the filled flag of every grid point, and the
+            # candidates of one block of soundings at a time.
+            memory_bytes["soundings"] = (memory_grid_bytes
+                                         + (3 * sum(sounding_counts) * np.dtype(np.float64).itemsize)
+                                         + (grid_points * ((3 * np.dtype(np.float64).itemsize) + 1))
+                                         + (min(max(sounding_counts, default=0), SOUNDINGS_BLOCK) * SOUNDING_BYTES))
+
+        block_steps = min(self._get_block_steps(), self.steps_x)
+        memory_bytes["triangulation"] = (memory_grid_bytes
+                                         + ((block_steps + 1) * (self.steps_y + 1) * TRIANGULATION_BYTES_PER_POINT))
+
+        plan = {"bounds": {"south": south, "west": west, "north": north, "east": east},
+                "tiles": [{"filename": filename, "bytes": size} for filename, size in tile_sizes],
+                "tile_bytes": tile_bytes,
+                "grid_points": grid_points,
+                "grid_file_bytes": grid_bytes if self.band_steps else 0,
+                "max_triangles": max_triangles,
+                "max_stl_bytes": HEADER_SIZE + 4 + (max_triangles * STL_DTYPE.itemsize),
+                "soundings": sum(sounding_counts),
+                "processes": processes,
+                "memory_bytes": memory_bytes}
+
+        missing_tiles = [filename for filename, size in tile_sizes if size is None]
+        logging.info(f"Plan: {len(tile_sizes)} tiles ({tile_bytes} bytes decoded, {len(missing_tiles)} missing), "
+                     f"{grid_points} grid points, at most {max_triangles} triangles and {plan['max_stl_bytes']} "
+                     f"bytes of STL")
+        logging.info(f"Plan: peak memory {memory_bytes}")
+        if calibrate:
+            plan["calibration"] = self._calibrate(processes=processes)
+        return plan
+
+    def _calibrate(self, processes):
+        """
+        Time sampling CALIBRATION_STRIPS strips across the map, then triangulating and writing a block of strips made
+        from them, in this process.  The sampling time includes opening the tiles, so it errs on the slow side.
 
+        :param processes: The number of processes the sampling will be spread over
+        :return: dict of the measured rate of each stage and the seconds that works out to for the whole map
+        """
+        self._open_elevations()
+        x_steps = np.unique(np.linspace(0, self.steps_x, CALIBRATION_STRIPS).round().astype(np.int64))
+        start = time.perf_counter()
+        strip_elevations = []
+        for x_step in x_steps:
+            latitudes, longitudes = self.get_grid_latitudes_longitudes(x_steps=[x_step])
+            strip_elevations.append(self.elevation_manager.get_elevations(latitudes=latitudes[0],
+                                                                          longitudes=longitudes[0]))
+        sampling_seconds = time.perf_counter() - start
+        sampled_points = len(x_steps) * (self.steps_y + 1)
+
+        rows = min(self._get_block_steps(), self.steps_x) + 1
+        elevations = np.stack(strip_elevations)[np.arange(rows) % len(strip_elevations)]
+        modeler = Modeler(size_x=self.size_x, size_y=self.size_y, steps_x=self.steps_x, steps_y=self.steps_y)
+        file_descriptor, stl_filename = tempfile.mkstemp(suffix=".stl")
+        os.close(file_descriptor)
+        try:
+            start = time.perf_counter()
+            with StlWriter(stl_filename) as stl_writer:
+                stl_writer.write(modeler.get_strip_faces(x_step=0,
+                                                         z_grid=self._get_z_for_elevations(elevations=elevations)))
+            triangulation_seconds = time.perf_counter() - start
+        finally:
+            os.remove(stl_filename)
+        triangulated_squares = (rows - 1) * self.steps_y
+
+        sampling_rate = sampled_points / sampling_seconds
+        triangulation_rate = triangulated_squares / triangulation_seconds
+        calibration = {"sampled_points": sampled_points,
+                       "sampling_points_per_second": sampling_rate,
+                       "sampling_seconds": (self.steps_x + 1) * (self.steps_y + 1) / (sampling_rate * processes),
+                       "triangulated_squares": triangulated_squares,
+                       "triangulation_squares_per_second": triangulation_rate,
+                       "triangulation_seconds": self.steps_x * self.steps_y / triangulation_rate}
+        logging.info(f"Calibration: {calibration}")
+        return calibration
+
+    def _get_block_steps(self):
+        """
+        :return: The number of strips _save_model triangulates and writes at a time
+        """
+        return self.band_steps or max(1, STRIP_BLOCK_POINTS // (self.steps_y + 1))
+
+    def _get_level(self, steps_x, steps_y):
+        """
+        :param steps_x: The steps along x of the level.  Divides this TerrainModeler's steps_x.
+        :param steps_y: The steps along y of the level.  Divides this TerrainModeler's steps_y.
+        :return: A copy of this TerrainModeler for the coarser grid, or this one for the same steps
+        """
+        if steps_x == self.steps_x and steps_y == self.steps_y:
+            return self
+        stride_x = self.steps_x // steps_x
+        stride_y = self.steps_y // steps_y
+        level = copy.copy(self)
+        level.steps_x = steps_x
+        level.steps_y = steps_y
+        level.x_step_meters = self.x_step_meters * stride_x
+        level.y_step_meters = self.y_step_meters * stride_y
+        level.longitude_delta = self.longitude_delta * stride_x
+        level.latitude_delta = self.latitude_delta * stride_y
+        return level
+
+    def _save_variant(self, variant):
+        """
+        Save one of the save_stls variants from the elevations in the map_grid.
+
+        :param variant: (filename, settings) as in save_stls
+        :return: None
+        """
+        filename, settings = variant
+        terrain_modeler = copy.copy(self)
+        for name, value in settings.items():
+            setattr(terrain_modeler, name, value)
+        logging.info(f"Building {filename} with {settings}")
+        latitudes, longitudes, elevations = self.map_grid.array
+        terrain_modeler._save_model(elevations=elevations, filename=filename)
+        del latitudes, longitudes, elevations
+
+    def _save_model(self, elevations, filename):
+        """
+        Turn the elevations into z heights and write the model to the STL a block of strips at a time, the sides first
+        and then the strips in order, as the Modeler has always laid them out.  Only one block of triangles is ever in
+        memory.  A block is band_steps strips, or about STRIP_BLOCK_POINTS grid points' worth.
+
+        :param elevations: NumPy array of the grid elevations, xyz depths and all, indexed [x_step][y_step]
+        :param filename: The filename to save the STL file to
+        :return: None
+        """
         self.modeler = Modeler(size_x=self.size_x,
                                size_y=self.size_y,
                                steps_x=self.steps_x,
-                               steps_y=self.steps_y,
-                               model_points=grid)
+                               steps_y=self.steps_y)
+        block_steps = self._get_block_steps()
 
         logging.info(f"Building Triangles")
-        self.modeler.generate_triangles(max_processes=self.max_processes)
-
-        logging.info(f"Building Faces")
-        self.modeler.generate_faces()
-
-        logging.info(f"Building Mesh")
-        self.modeler.generate_mesh()
-
-        logging.info(f"Saving File")
-        self.modeler.save_stl(filename)
+        with StlWriter(filename) as stl_writer:
+            stl_writer.write(self.modeler.get_side_faces(
+                front_z=self._get_z_for_elevations(elevations=elevations[:, 0]),
+                rear_z=self._get_z_for_elevations(elevations=elevations[:, self.steps_y]),
+                left_z=self._get_z_for_elevations(elevations=elevations[0]),
+                right_z=self._get_z_for_elevations(elevations=elevations[self.steps_x])))
+            for block_start in range(0, self.steps_x, block_steps):
+                block_end = min(block_start + block_steps, self.steps_x)
+                logging.debug(f"Building x steps {block_start} to {block_end}")
+                z_grid = self._get_z_for_elevations(elevations=elevations[block_start:block_end + 1])
+                stl_writer.write(self.modeler.get_strip_faces(x_step=block_start, z_grid=z_grid))
 
         logging.info(f"Zero elevation z-height: {self._get_z_for_elevation(0)}")
 
@@ -166,173 +498,353 @@ class TerrainModeler:
 
         logging.info(f"Done")
 
-    def _build_grid(self):
+    def _get_map_bounds(self):
+        """
+        The map's x-axis runs along the geodesic heading east from the origin, so it drifts slightly towards the
+        equator, and the y-axis runs due north from there.  That makes the corners the extremes.  Half a step is
+        added all around for SamplingMode.AREA cells on the edges.
+
+        :return: (south, west, north, east) that contains every point of the map
+        """
+        latitudes, longitudes = self.get_grid_latitudes_longitudes(x_steps=[0, self.steps_x])
+        corner_latitudes = latitudes[:, [0, -1]]
+        corner_longitudes = longitudes[:, [0, -1]]
+        return (float(corner_latitudes.min()) - abs(self.latitude_delta) / 2,
+                float(corner_longitudes.min()) - abs(self.longitude_delta) / 2,
+                float(corner_latitudes.max()) + abs(self.latitude_delta) / 2,
+                float(corner_longitudes.max()) + abs(self.longitude_delta) / 2)
+
+    def _get_xyz_files(self):
+        """
+        :return: list of (surface elevation, xyz filename, DepthUnit) for every file in the xyz_config.  A file given
+            as just a filename is in feet, like the NOAA files.
+        """
+        xyz_files = []
+        for surface_elevation, files in self.xyz_config.items():
+            for xyz_file in files:
+                if isinstance(xyz_file, str):
+                    xyz_files.append((surface_elevation, xyz_file, DepthUnit.FEET))
+                else:
+                    xyz_filename, depth_unit = xyz_file
+                    xyz_files.append((surface_elevation, xyz_filename, depth_unit))
+        return xyz_files
+
+    def _sample_grid(self, grid_filename=None):
+        """
+        Sample the elevation of every grid point into a new map_grid, then carve the xyz depths into it.  The caller
+        closes the map_grid when it's done with it.
+
+        :param grid_filename: The file to keep the map_grid in.  Default is None, which keeps it in shared memory.
+        :return: None
+        """
+        self._open_elevations()
+
         logging.info(f"Building Model Grid")
+        # The workers write their strips straight into this and return nothing, so nothing but the x_step goes
+        # through the Pool either way.
+        shape = (3, self.steps_x + 1, self.steps_y + 1)
+        if grid_filename is None:
+            self.map_grid = SharedArray(shape=shape, dtype=np.float64)
+        else:
+            self.map_grid = MappedArray(filename=grid_filename, shape=shape, dtype=np.float64)
         with Pool(self.max_processes) as p:
-            map_grid = p.map(self._build_map_line, range(0, self.steps_x + 1))
-        logging.debug(f"map_grid: {map_grid}")
+            p.map(self._build_map_line, range(0, self.steps_x + 1))
+        latitudes, longitudes, elevations = self.map_grid.array
+        logging.debug(f"elevations: {elevations}")
 
-        override_grid = [[None] * (self.steps_y + 1) for i in range(0, self.steps_x + 1)]
         if self.xyz_config:
-            maximum_delta = math.sqrt((self.x_step_meters * self.x_step_meters) + (self.y_step_meters * self.y_step_meters)) * 0.7
-            override_points_to_expand = []
-            for surface_elevation, files in self.xyz_config.items():
-                logging.info(f"Processing surface_elevation {surface_elevation} files from {files}")
-                for xyz_file in files:
-                    with (open(xyz_file) as f):
-                        file_format = None
-                        for line in f.readlines():
-                            if file_format is None:
-                                if line.count(',') == 5 and line.count('\t') == 0:
-                                    file_format = XYZFileTypes.TYPE_A
-                                    logging.info(f"Found TypeA File")
-                                elif line.count(',') == 0 and line.count('\t') == 3:
-                                    file_format = XYZFileTypes.TYPE_B
-                                    logging.info(f"Found TypeB File")
-                                else:
-                                    raise TypeError(f"File type of {xyz_file} is unknown. Pattern is: {line.count(',')}-{line.count('\t')}")
-                            else:
-                                if file_format == XYZFileTypes.TYPE_A:
-                                    survey_id, latitude, longitude, depth, quality_code, active = line.split(',')
-                                elif file_format == XYZFileTypes.TYPE_B:
-                                    survey_id, longitude, latitude, depth = line.split('\t')
-                                latitude = float(latitude)
-                                longitude = float(longitude)
-
-                                # This is always feet? ##TODO Confirm this! Parameterize in config? huh?
-                                depth_meters = float(depth) / 3.28084
-
-                                y_guess = math.floor((latitude - self.map_origin.latitude) / self.latitude_delta)
-                                x_guess = math.floor((longitude - self.map_origin.longitude) / self.longitude_delta)
-                                for x_step in range(x_guess - 2, x_guess + 2):
-                                    for y_step in range(y_guess - 2, y_guess + 2):
-                                        map_point = Point(latitude=map_grid[x_step][y_step].latitude, longitude=map_grid[x_step][y_step].longitude)
-                                        map_elevation = map_grid[x_step][y_step].altitude * 1000
-                                        if abs(surface_elevation - map_elevation) < 1:
-                                            delta_distance = distance.geodesic(map_point, Point(latitude=latitude, longitude=longitude)).m
-                                            if delta_distance < maximum_delta:
-                                                logging.debug(f"FOUND: [{x_step},{y_step}] vs [{x_guess},{y_guess}]")
-                                                if override_grid[x_step][y_step] is None:
-                                                    override_grid[x_step][y_step] = (-depth_meters, delta_distance)
-                                                    override_points_to_expand.append((x_step, y_step, surface_elevation, depth_meters))
-                                                elif delta_distance < override_grid[x_step][y_step][1]:
-                                                    override_grid[x_step][y_step] = (-depth_meters, delta_distance)
-                                                elif depth_meters > abs(override_grid[x_step][y_step][0]):
-                                                    override_grid[x_step][y_step] = (-depth_meters, delta_distance)
-
-            logging.debug(f"override_grid: {override_grid}")
-            while override_points_to_expand:
-                logging.debug(f"override_points_to_expand: {len(override_points_to_expand)}")
-                x_step, y_step, surface_elevation, depth_meters = override_points_to_expand.pop()
-                neighbors = [(x_step - 1, y_step),
-                             (x_step + 1, y_step),
-                             (x_step, y_step - 1),
-                             (x_step, y_step + 1)]
-                logging.debug(f"[{x_step},{y_step}] = {neighbors}")
-                for neighbor_x, neighbor_y in neighbors:
-                    if override_grid[neighbor_x][neighbor_y] is None:
-                        neighbor_elevation = map_grid[neighbor_x][neighbor_y].altitude * 1000
-                        if abs(surface_elevation - neighbor_elevation) < 1:
-                            override_grid[neighbor_x][neighbor_y] = (-depth_meters, None)
-                            override_points_to_expand.append((neighbor_x, neighbor_y, surface_elevation, depth_meters))
-
-        grid = []
-        for x_step in range(0, self.steps_x + 1):
-            grid.append([])
-            for y_step in range(0, self.steps_y + 1):
-                x, y = Modeler.get_model_x_y_for_steps(size_x=self.size_x, size_y=self.size_y,
-                                                       x_step=x_step, y_step=y_step,
-                                                       steps_x=self.steps_x, steps_y=self.steps_y)
-                if override_grid[x_step][y_step] is None:
-                    z = self._get_z_for_altitude(altitude=map_grid[x_step][y_step].altitude)
-                else:
-                    z = self._get_z_for_elevation(elevation=(map_grid[x_step][y_step].altitude * 1000) + override_grid[x_step][y_step][0])
-                    logging.debug(f"Moving {x},{y} from {self._get_z_for_altitude(altitude=map_grid[x_step][y_step].altitude)} to {z}")
-                model_point = ModelPoint(x, y, z)
-                grid[x_step].append(model_point)
-        return grid
-
-    def _build_map_line(self, x_step):
-        x_points = []
-        for y_step in range(0, self.steps_y + 1):
-            map_point = self._get_point_from_xy_steps(x_step=x_step, y_step=y_step)
-            x_points.append(map_point)
-        return x_points
-
-    def _build_model_line(self, x_step):
-        x_points = []
-        for y_step in range(0, self.steps_y + 1):
-            x, y = Modeler.get_model_x_y_for_steps(size_x=self.size_x, size_y=self.size_y,
-                                                   x_step=x_step, y_step=y_step,
-                                                   steps_x=self.steps_x, steps_y=self.steps_y)
-            map_point = self._get_point_from_xy_steps(x_step=x_step, y_step=y_step)
-            z = self._get_z_for_altitude(altitude=map_point.altitude)
-            logging.debug(f"(x, y, z) = ({x}, {y}, {z}) = ({map_point.format_decimal(altitude='m')}")
-            model_point = ModelPoint(x, y, z)
-            x_points.append(model_point)
-        return x_points
-
-    def _get_z_for_altitude(self, altitude):
-        # I do elevation in m.  Geopy does altitude in km.
-        elevation = round((altitude * 1000), 2)
-        return self._get_z_for_elevation(elevation=elevation)
+            self._apply_soundings(soundings=self._load_soundings(),
+                                  latitudes=latitudes,
+                                  longitudes=longitudes,
+                                  elevations=elevations)
 
-    def _get_z_for_elevation(self, elevation):
-        round_elecation = round(elevation, 2)
-        logging.debug(f"Elevation: {round_elecation}")
-        if round_elecation in self.z_cache:
-            return self.z_cache[round_elecation]
-
-        if (round_elecation < self.flatten_reference_elevation_meters
-                and self.flatten_mode in [FlattenMode.BOTH, FlattenMode.NEGATIVE]):
-            elevation_delta = self.flatten_reference_elevation_meters - round_elecation
-            flattened_elevation_delta = math.pow(abs(elevation_delta), self.flatten_factor)
-            adjusted_elevation = (self.flatten_reference_elevation_meters
-                                  - flattened_elevation_delta
-                                  - self.offset_elevation)
-            logging.debug(
-                f"Flatten Negative: {round_elecation} --> {adjusted_elevation} on {self.flatten_reference_elevation_meters} "
-                f"and {elevation_delta} and {flattened_elevation_delta}")
-        elif (round_elecation > self.flatten_reference_elevation_meters
-              and self.flatten_mode in [FlattenMode.BOTH, FlattenMode.POSITIVE]):
-            elevation_delta = round_elecation - self.flatten_reference_elevation_meters
-            flattened_elevation_delta = math.pow(abs(elevation_delta), self.flatten_factor)
-            adjusted_elevation = ((self.flatten_reference_elevation_meters + flattened_elevation_delta)
-                                  - self.offset_elevation)
-            logging.debug(
-                f"Flatten Positive: {round_elecation} --> {adjusted_elevation} on {self.flatten_reference_elevation_meters} "
-                f"and {elevation_delta} and {flattened_elevation_delta}")
-        else:
-            adjusted_elevation = round_elecation - self.offset_elevation
+    def _open_elevations(self):
+        """
+        Get the ElevationManager ready to sample the map: the persistent cache, the tiles and the mosaic.
 
-        z = round((adjusted_elevation / self.meters_model_ratio) * self.scale_z, 2)
-        if self.min_allowed_z and z < self.min_allowed_z:
-            logging.info(f"Your point's final {z} is less then the allowed {self.min_allowed_z}, moving it up.")
-            z = self.min_allowed_z
+        :return: None
+        """
+        logging.info(f"Prefetching Elevation Tiles")
+        south, west, north, east = self._get_map_bounds()
+        self.elevation_manager.open_persistent_cache(south=south, west=west, north=north, east=east)
+        self.elevation_manager.prefetch_tiles(south=south, west=west, north=north, east=east)
+        if self.use_mosaic:
+            self.elevation_manager.build_mosaic(south=south, west=west, north=north, east=east)
+
+    def _load_soundings(self):
+        """
+        :return: list of (surface elevation, Soundings) for every file in the xyz_config
+        """
+        xyz_files = self._get_xyz_files()
+        logging.info(f"Loading {len(xyz_files)} xyz files")
+        all_soundings = Soundings.from_xyz_files(xyz_files=[(xyz_file, depth_unit)
+                                                            for surface_elevation, xyz_file, depth_unit in xyz_files],
+                                                 max_processes=self.max_processes,
+                                                 cache_folder=self.persistent_cache_folder)
+        return [(surface_elevation, soundings)
+                for (surface_elevation, xyz_file, depth_unit), soundings in zip(xyz_files, all_soundings)]
+
+    def _apply_soundings(self, soundings, latitudes, longitudes, elevations):
+        """
+        Move the grid points in the water down to the depths of the soundings.
 
-        if z < 0:
-            z = 0
-        logging.debug(f"z: {z}")
-        return z
+        :param soundings: list of (surface elevation, Soundings) from _load_soundings
+        :param latitudes: NumPy array of the grid latitudes, indexed [x_step][y_step]
+        :param longitudes: NumPy array of the grid longitudes, indexed [x_step][y_step]
+        :param elevations: NumPy array of the grid elevations, indexed [x_step][y_step].  Changed in place.
+        :return: None
+        """
+        override_depths, override_surfaces = self._assign_soundings(
+            surface_elevations=[surface_elevation for surface_elevation, surface_soundings in soundings],
+            all_soundings=[surface_soundings for surface_elevation, surface_soundings in soundings],
+            latitudes=latitudes,
+            longitudes=longitudes,
+            elevations=elevations)
+        self._expand_overrides(override_depths=override_depths,
+                               override_surfaces=override_surfaces,
+                               elevations=elevations)
+
+        overridden = ~np.isnan(override_depths)
+        logging.info(f"Moving {np.count_nonzero(overridden)} points down to the xyz depths")
+        elevations[overridden] -= override_depths[overridden]
+
+    def _assign_soundings(self, surface_elevations, all_soundings, latitudes, longitudes, elevations):
+        """
+        Give each grid point at a water surface the depth of a sounding near it.  Each sounding is a candidate for the
+        4x4 grid points around it, if they are at its surface elevation (within 1m) and closer than 0.7 of a grid step
+        diagonal.  The candidates for a grid point take their turns in the order they are given (each Soundings in
+        turn, and each in file order), and each one takes the point if it is closer than the sounding that has it or
+        deeper.  So the order matters, and the result is the same as applying the soundings one at a time in that
+        order.  It is all done in blocks of soundings with NumPy, one turn of every grid point at a time.
+
+        :param surface_elevations: list of the water surface elevation of each Soundings
+        :param all_soundings: list of Soundings
+        :param latitudes: NumPy array of the grid latitudes, indexed [x_step][y_step]
+        :param longitudes: NumPy array of the grid longitudes, indexed [x_step][y_step]
+        :param elevations: NumPy array of the grid elevations, indexed [x_step][y_step]
+        :return: (depths, surface elevations) NumPy arrays indexed [x_step][y_step] of the winning sounding for each
+            grid point.  NaN where no sounding is close enough.
+        """
+        maximum_delta = math.sqrt((self.x_step_meters * self.x_step_meters) + (self.y_step_meters * self.y_step_meters)) * 0.7
+        steps_x, steps_y = elevations.shape
+        best_distances = np.full(elevations.shape, np.inf)
+        best_depths = np.full(elevations.shape, np.nan)
+        best_surfaces = np.full(elevations.shape, np.nan)
+        x_offsets, y_offsets = np.meshgrid(np.arange(-2, 2), np.arange(-2, 2), indexing='ij')
+        x_offsets = x_offsets.ravel()
+        y_offsets = y_offsets.ravel()
+        for surface_elevation, soundings in zip(surface_elevations, all_soundings):
+            # Soundings more than a couple of rows off the map can't reach it.
+            soundings = soundings.between_latitudes(
+                south=self.map_origin.latitude - (2 * self.latitude_delta),
+                north=self.map_origin.latitude + ((steps_y + 2) * self.latitude_delta))
+            logging.info(f"Processing surface_elevation {surface_elevation}, {len(soundings)} soundings")
+            for start in range(0, len(soundings), SOUNDINGS_BLOCK):
+                sounding_latitudes = soundings.latitudes[start:start + SOUNDINGS_BLOCK]
+                sounding_longitudes = soundings.longitudes[start:start + SOUNDINGS_BLOCK]
+                sounding_depths = soundings.depths[start:start + SOUNDINGS_BLOCK]
+                y_guesses = np.floor((sounding_latitudes - self.map_origin.latitude) / self.latitude_delta).astype(np.int64)
+                x_guesses = np.floor((sounding_longitudes - self.map_origin.longitude) / self.longitude_delta).astype(np.int64)
+
+                # Every (sounding, grid point) candidate pair, as flat arrays.
+                sounding_indexes = np.repeat(np.arange(len(sounding_depths)), len(x_offsets))
+                x_steps = (x_guesses[:, np.newaxis] + x_offsets[np.newaxis, :]).ravel()
+                y_steps = (y_guesses[:, np.newaxis] + y_offsets[np.newaxis, :]).ravel()
+                candidates = (x_steps >= 0) & (x_steps < steps_x) & (y_steps >= 0) & (y_steps < steps_y)
+                sounding_indexes = sounding_indexes[candidates]
+                x_steps = x_steps[candidates]
+                y_steps = y_steps[candidates]
+
+                candidates = np.abs(surface_elevation - elevations[x_steps, y_steps]) < 1
+                sounding_indexes = sounding_indexes[candidates]
+                x_steps = x_steps[candidates]
+                y_steps = y_steps[candidates]
+
+                distances = get_distances(latitudes[x_steps, y_steps], longitudes[x_steps, y_steps],
+                                          sounding_latitudes[sounding_indexes], sounding_longitudes[sounding_indexes])
+                candidates = distances < maximum_delta
+                depths = sounding_depths[sounding_indexes[candidates]]
+                distances = distances[candidates]
+                cells = x_steps[candidates] * steps_y + y_steps[candidates]
+
+                # Number the candidates of each cell in sounding order, then group them by that turn.
+                by_cell = np.argsort(cells, kind='stable')
+                firsts = np.ones(len(cells), dtype=bool)
+                firsts[1:] = cells[by_cell][1:] != cells[by_cell][:-1]
+                first_indexes = np.flatnonzero(firsts)
+                turns = np.arange(len(cells)) - np.repeat(first_indexes, np.diff(np.append(first_indexes, len(cells))))
+                by_turn = np.argsort(turns, kind='stable')
+                turn_count = turns.max() + 1 if len(turns) else 0
+                turn_starts = np.searchsorted(turns[by_turn], np.arange(turn_count + 1))
+                order = by_cell[by_turn]
+                cells = cells[order]
+                depths = depths[order]
+                distances = distances[order]
+
+                flat_distances = best_distances.reshape(-1)
+                flat_depths = best_depths.reshape(-1)
+                flat_surfaces = best_surfaces.reshape(-1)
+                for start_index, end_index in zip(turn_starts[:-1], turn_starts[1:]):
+                    turn_cells = cells[start_index:end_index]
+                    turn_distances = distances[start_index:end_index]
+                    turn_depths = depths[start_index:end_index]
+                    better = ((turn_distances < flat_distances[turn_cells])
+                              | (turn_depths > np.abs(flat_depths[turn_cells])))
+                    turn_cells = turn_cells[better]
+                    flat_distances[turn_cells] = turn_distances[better]
+                    flat_depths[turn_cells] = turn_depths[better]
+                    flat_surfaces[turn_cells] = surface_elevation
+        logging.info(f"{np.count_nonzero(~np.isnan(best_depths))} grid points have a sounding")
+        return best_depths, best_surfaces
+
+    @staticmethod
+    def _expand_overrides(override_depths, override_surfaces, elevations):
+        """
+        Spread the sounding depths to the rest of the water the soundings are in.  Every grid point at the surface
+        elevation of a sounded neighbor takes that neighbor's depth, and so on out, one ring of grid points at a time
+        from all the soundings at once.  So each point ends up with the depth of the nearest sounding (in grid steps)
+        connected to it through water, or the deepest of them if several are just as near.  The edges of the grid are
+        the edges; nothing wraps around.
+
+        This is not what the old stack of points to expand did, so models with soundings come out a little different.
+        It walked out depth first from the last sounded point, so a point took the depth of whichever sounding's walk
+        got to it first, however far away, and a walk carried the depth its sounded point had when it was first
+        assigned, not the one that won it.  The sounded points themselves are the same.
+
+        :param override_depths: NumPy array of the depths from _assign_soundings, filled in place
+        :param override_surfaces: NumPy array of the surface elevations from _assign_soundings, filled in place
+        :param elevations: NumPy array of the grid elevations
+        :return: None
+        """
+        steps_x, steps_y = elevations.shape
+        depths = override_depths.reshape(-1)
+        surfaces = override_surfaces.reshape(-1)
+        flat_elevations = elevations.reshape(-1)
+        filled = ~np.isnan(depths)
+        frontier = np.flatnonzero(filled)
+        rings = 0
+        while frontier.size:
+            x_steps = frontier // steps_y
+            y_steps = frontier % steps_y
+            targets = []
+            sources = []
+            for x_offset, y_offset in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                neighbor_x_steps = x_steps + x_offset
+                neighbor_y_steps = y_steps + y_offset
+                inside = ((neighbor_x_steps >= 0) & (neighbor_x_steps < steps_x)
+                          & (neighbor_y_steps >= 0) & (neighbor_y_steps < steps_y))
+                neighbors = neighbor_x_steps[inside] * steps_y + neighbor_y_steps[inside]
+                neighbor_sources = frontier[inside]
+                water = ~filled[neighbors] & (np.abs(surfaces[neighbor_sources] - flat_elevations[neighbors]) < 1)
+                targets.append(neighbors[water])
+                sources.append(neighbor_sources[water])
+            targets = np.concatenate(targets)
+            sources = np.concatenate(sources)
+
+            # A point reached from more than one side takes the deepest.
+            order = np.lexsort((-depths[sources], targets))
+            targets = targets[order]
+            sources = sources[order]
+            firsts = np.ones(len(targets), dtype=bool)
+            firsts[1:] = targets[1:] != targets[:-1]
+            targets = targets[firsts]
+            sources = sources[firsts]
+
+            depths[targets] = depths[sources]
+            surfaces[targets] = surfaces[sources]
+            filled[targets] = True
+            frontier = targets
+            rings += 1
+        logging.debug(f"Expanded the soundings {rings} rings out")
+
+    def get_grid_latitudes_longitudes(self, x_steps=None):
+        """
+        :param x_steps: The x steps to get the points for.  Default is all of them.
+        :return: (latitudes, longitudes) NumPy arrays of the map grid points at sea level, indexed [x_step][y_step]
+        """
+        if x_steps is None:
+            x_steps = np.arange(self.steps_x + 1)
+        return get_grid(latitude=self.map_origin.latitude,
+                        longitude=self.map_origin.longitude,
+                        x_meters=np.asarray(x_steps) * self.x_step_meters,
+                        y_meters=np.arange(self.steps_y + 1) * self.y_step_meters,
+                        grid_mode=self.grid_mode)
+
+    def _build_map_line(self, x_step, y_steps=None):
+        """
+        Sample one strip of the map into the shared map_grid.
 
-    def _get_point_from_xy_steps(self, x_step, y_step):
-        return self._get_point_from_xy_meters(x_meters=(x_step * self.x_step_meters),
-                                              y_meters=(y_step * self.y_step_meters))
+        :param x_step: The x step of the strip
+        :param y_steps: NumPy array of the y steps to sample.  Default is the whole strip.
+        :return: None
+        """
+        # The whole strip is laid out even for a few y steps.  The geodesy iterates until every point in the call has
+        # converged, so this way a point comes out to the last bit the same however it is sampled.
+        latitudes, longitudes = self.get_grid_latitudes_longitudes(x_steps=[x_step])
+        latitudes = latitudes[0]
+        longitudes = longitudes[0]
+        if y_steps is None:
+            y_steps = slice(None)
+        else:
+            latitudes = latitudes[y_steps]
+            longitudes = longitudes[y_steps]
+        elevations = self.elevation_manager.get_elevations(latitudes=latitudes, longitudes=longitudes)
+        grid_latitudes, grid_longitudes, grid_elevations = self.map_grid.array
+        grid_latitudes[x_step, y_steps] = latitudes
+        grid_longitudes[x_step, y_steps] = longitudes
+        grid_elevations[x_step, y_steps] = elevations
+        logging.debug(f"Tile cache after x_step {x_step}: {self.elevation_manager.get_tile_cache_stats()}")
+
+    def _get_z_for_elevations(self, elevations):
+        """
+        Flatten, offset, scale and clamp a whole grid of elevations at once.  The rounding is done like round() so
+        the z heights are exactly what the old one point at a time version gave.
 
-    def _get_point_from_xy_meters(self, x_meters, y_meters):
+        :param elevations: NumPy array of elevations in meters
+        :return: NumPy array of the z heights in the model, the same shape as elevations
         """
-        _get_point_from_xy_meters - Get the Point for the location on the map, including elevation.
+        round_elevations = self._round(elevations, 2)
+        adjusted_elevations = round_elevations - self.offset_elevation
+        if self.flatten_mode in [FlattenMode.BOTH, FlattenMode.NEGATIVE]:
+            below = round_elevations < self.flatten_reference_elevation_meters
+            flattened_elevation_deltas = np.power(np.abs(self.flatten_reference_elevation_meters - round_elevations[below]),
+                                                  self.flatten_factor)
+            adjusted_elevations[below] = (self.flatten_reference_elevation_meters
+                                          - flattened_elevation_deltas
+                                          - self.offset_elevation)
+        if self.flatten_mode in [FlattenMode.BOTH, FlattenMode.POSITIVE]:
+            above = round_elevations > self.flatten_reference_elevation_meters
+            flattened_elevation_deltas = np.power(np.abs(round_elevations[above] - self.flatten_reference_elevation_meters),
+                                                  self.flatten_factor)
+            adjusted_elevations[above] = ((self.flatten_reference_elevation_meters + flattened_elevation_deltas)
+                                          - self.offset_elevation)
+
+        z = self._round((adjusted_elevations / self.meters_model_ratio) * self.scale_z, 2)
+        if self.min_allowed_z:
+            too_low = z < self.min_allowed_z
+            if too_low.any():
+                logging.info(f"{np.count_nonzero(too_low)} points' final z is less then the allowed {self.min_allowed_z}, moving them up.")
+                z[too_low] = self.min_allowed_z
+        z[z < 0] = 0
+        return z
 
-        :param y_meters: the number of meters north to go on the map from the origin point
-        :param y_meters: the number of meters east to go on the map from the origin point
+    @staticmethod
+    def _round(values, digits):
+        """
+        np.round scales, rounds and scales back, so right on a half it can land on the other side from Python's
+        round, which works from the exact decimal value.  Those few are done again with round.
 
-        :return: Point with the final location and elevation
+        :param values: NumPy array of values
+        :param digits: The number of decimal places
+        :return: NumPy array of the values rounded exactly like round(value, digits)
         """
-        endpoint_sealevel = distance.distance(meters=y_meters).destination(distance.distance(meters=x_meters).destination(self.map_origin, bearing=90), bearing=0)
-        elevation = self.elevation_manager.get_elevation_for_latitude_longitude(latitude=endpoint_sealevel.latitude,
-                                                                                longitude=endpoint_sealevel.longitude)
-        endpoint = Point(latitude=endpoint_sealevel.latitude,
-                         longitude=endpoint_sealevel.longitude,
-                         altitude=Point.parse_altitude(distance=elevation, unit='m'))
-        logging.debug(f"endpoint: {endpoint.format_decimal(altitude='m')}")
-        return endpoint
+        values = np.asarray(values, dtype=np.float64)
+        rounded = np.round(values, digits)
+        scaled = values * (10 ** digits)
+        near_half = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) < 1e-6
+        for index in zip(*np.nonzero(near_half)):
+            rounded[index] = round(float(values[index]), digits)
+        return rounded
+
+    def _get_z_for_elevation(self, elevation):
+        return float(self._get_z_for_elevations(elevations=np.array([elevation], dtype=np.float64))[0])
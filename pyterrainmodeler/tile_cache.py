@@ -0,0 +1,107 @@
+"""tile_cache.py:
+    This defines the TileCache, the least recently used cache of open ElevationTiles that each ElevationManager keeps.
+    It has a budget in bytes per process.  When a new tile pushes it over the budget, the tiles that have not been used
+    for the longest are closed and dropped until it fits again, so a map spanning many tiles does not keep all of them
+    in every gridding process.  The contents are never pickled; every process starts with an empty cache.
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+import logging
+from collections import OrderedDict
+
+
+class TileCache(object):
+
+    def __init__(self, max_bytes=None):
+        """
+        :param max_bytes: The most bytes of tiles to keep open at once.  None for no limit.  The most recently used
+            tile is always kept, even if it alone is over the budget.
+        """
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(max_bytes=state["max_bytes"])
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def get(self, key):
+        """
+        :param key: The key of the tile, usually its filename
+        :return: The tile, or None if it is not in the cache
+        """
+        tile = self.tiles.get(key)
+        if tile is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tiles.move_to_end(key)
+        return tile
+
+    def put(self, key, tile):
+        """
+        :param key: The key of the tile, usually its filename
+        :param tile: The ElevationTile
+        :return: None
+        """
+        if key in self.tiles:
+            self._remove(key)
+        self.tiles[key] = tile
+        self.bytes += tile.get_size()
+        self.evict()
+
+    def evict(self):
+        """
+        Close and drop the least recently used tiles until the cache is inside its budget.
+        :return: None
+        """
+        if self.max_bytes is None:
+            return
+        while self.bytes > self.max_bytes and len(self.tiles) > 1:
+            key = next(iter(self.tiles))
+            self._remove(key)
+            self.evictions += 1
+            logging.debug(f"Evicted tile {key}, {len(self.tiles)} tiles and {self.bytes} bytes still open")
+
+    def clear(self):
+        """
+        :return: None
+        """
+        for key in list(self.tiles):
+            self._remove(key)
+
+    def get_stats(self):
+        """
+        :return: dict of the hit, miss and eviction counters along with the current size of the cache
+        """
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "tiles": len(self.tiles),
+                "bytes": self.bytes}
+
+    def _remove(self, key):
+        """
+        :param key: The key of the tile to close and drop
+        :return: None
+        """
+        tile = self.tiles.pop(key)
+        self.bytes -= tile.get_size()
+        tile.close()
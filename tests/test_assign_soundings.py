@@ -0,0 +1,135 @@
+"""test_assign_soundings.py:
+    Checks that TerrainModeler._assign_soundings gives every grid point the same sounding as applying the soundings
+    one at a time, in the order they are given, with the "closer or deeper wins" rule.  The soundings are random, so
+    they are not sorted in any way, and some sit on top of each other so that only the order decides between them.
+    __author__      = "Unintelligible Maker"
+    __copyright__   = "Copyright 2024"
+    __license__     = "MIT License"
+    __version__     = "1.0"
+    __maintainer__  = "Unintelligible Maker"
+    __email__       = "maker@unintelligiblemaker.com"
+    __project__     = "PyTerrainModeler"
+"""
+
+import math
+import numpy as np
+import pytest
+import pyterrainmodeler.terrain_modeler as terrain_modeler
+from pyterrainmodeler.bathymetry import Soundings
+from pyterrainmodeler.geodesy import get_distances
+from pyterrainmodeler.terrain_modeler import TerrainModeler
+
+LAKE_ELEVATION = 100.0
+POND_ELEVATION = 150.0
+STEPS = 20
+
+
+def get_terrain_modeler():
+    return TerrainModeler(latitude=46.7, longitude=-122.2, longitude_size=0.02, size_x=100, size_y=100,
+                          steps_x=STEPS, steps_y=STEPS, max_processes=1)
+
+
+def get_elevations():
+    """
+    :return: A lake over most of the grid, a pond up on the west side and a strip of land between them
+    """
+    elevations = np.full((STEPS + 1, STEPS + 1), LAKE_ELEVATION)
+    elevations[:5] = POND_ELEVATION
+    elevations[5:7] = POND_ELEVATION + 20
+    return elevations
+
+
+def get_soundings(terrain_model, count, seed):
+    """
+    :return: count random Soundings over the grid and a little past its edges, the last quarter of them on top of
+        earlier ones
+    """
+    rng = np.random.default_rng(seed)
+    latitudes = terrain_model.map_origin.latitude + rng.uniform(-3, STEPS + 3, count) * terrain_model.latitude_delta
+    longitudes = terrain_model.map_origin.longitude + rng.uniform(-3, STEPS + 3, count) * terrain_model.longitude_delta
+    depths = rng.uniform(1, 30, count).round(1)
+    repeats = rng.integers(0, count * 3 // 4, count // 4)
+    latitudes[count * 3 // 4:] = latitudes[repeats]
+    longitudes[count * 3 // 4:] = longitudes[repeats]
+    return Soundings(latitudes=latitudes, longitudes=longitudes, depths=depths)
+
+
+def assign_one_at_a_time(terrain_model, surface_elevations, all_soundings, latitudes, longitudes, elevations):
+    """
+    The loop _assign_soundings replaced, with the grid edges checked instead of wrapping around.
+    """
+    maximum_delta = math.sqrt((terrain_model.x_step_meters * terrain_model.x_step_meters)
+                              + (terrain_model.y_step_meters * terrain_model.y_step_meters)) * 0.7
+    steps_x, steps_y = elevations.shape
+    depths = np.full(elevations.shape, np.nan)
+    distances = np.full(elevations.shape, np.nan)
+    surfaces = np.full(elevations.shape, np.nan)
+    for surface_elevation, soundings in zip(surface_elevations, all_soundings):
+        for latitude, longitude, depth in zip(soundings.latitudes, soundings.longitudes, soundings.depths):
+            y_guess = math.floor((latitude - terrain_model.map_origin.latitude) / terrain_model.latitude_delta)
+            x_guess = math.floor((longitude - terrain_model.map_origin.longitude) / terrain_model.longitude_delta)
+            for x_step in range(x_guess - 2, x_guess + 2):
+                for y_step in range(y_guess - 2, y_guess + 2):
+                    if not (0 <= x_step < steps_x and 0 <= y_step < steps_y):
+                        continue
+                    if abs(surface_elevation - elevations[x_step][y_step]) < 1:
+                        delta_distance = get_distances(latitudes[x_step][y_step], longitudes[x_step][y_step],
+                                                       latitude, longitude)
+                        if delta_distance < maximum_delta:
+                            if (np.isnan(depths[x_step][y_step]) or delta_distance < distances[x_step][y_step]
+                                    or depth > abs(depths[x_step][y_step])):
+                                depths[x_step][y_step] = depth
+                                distances[x_step][y_step] = delta_distance
+                                surfaces[x_step][y_step] = surface_elevation
+    return depths, surfaces
+
+
+@pytest.mark.parametrize("soundings_block", [7, 100, 2 ** 20])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_assign_soundings_matches_one_at_a_time(monkeypatch, soundings_block, seed):
+    monkeypatch.setattr(terrain_modeler, "SOUNDINGS_BLOCK", soundings_block)
+    terrain_model = get_terrain_modeler()
+    latitudes, longitudes = terrain_model.get_grid_latitudes_longitudes()
+    elevations = get_elevations()
+    surface_elevations = [LAKE_ELEVATION, POND_ELEVATION, LAKE_ELEVATION]
+    all_soundings = [get_soundings(terrain_model, count=400, seed=seed),
+                     get_soundings(terrain_model, count=100, seed=seed + 100),
+                     get_soundings(terrain_model, count=200, seed=seed + 200)]
+    assert not np.all(np.diff(all_soundings[0].latitudes) >= 0)
+
+    depths, surfaces = terrain_model._assign_soundings(surface_elevations=surface_elevations,
+                                                       all_soundings=all_soundings,
+                                                       latitudes=latitudes,
+                                                       longitudes=longitudes,
+                                                       elevations=elevations)
+    expected_depths, expected_surfaces = assign_one_at_a_time(terrain_model, surface_elevations, all_soundings,
+                                                              latitudes, longitudes, elevations)
+    assert np.count_nonzero(~np.isnan(expected_depths)) > STEPS * STEPS // 2
+    np.testing.assert_array_equal(depths, expected_depths)
+    np.testing.assert_array_equal(surfaces, expected_surfaces)
+
+
+def test_assign_soundings_depends_on_order():
+    terrain_model = get_terrain_modeler()
+    latitudes, longitudes = terrain_model.get_grid_latitudes_longitudes()
+    elevations = get_elevations()
+    soundings = get_soundings(terrain_model, count=400, seed=1)
+    order = np.lexsort((soundings.longitudes, soundings.latitudes))
+    sorted_soundings = Soundings(latitudes=soundings.latitudes[order],
+                                 longitudes=soundings.longitudes[order],
+                                 depths=soundings.depths[order])
+
+    depths, _ = terrain_model._assign_soundings(surface_elevations=[LAKE_ELEVATION],
+                                                all_soundings=[soundings],
+                                                latitudes=latitudes,
+                                                longitudes=longitudes,
+                                                elevations=elevations)
+    sorted_depths, _ = terrain_model._assign_soundings(surface_elevations=[LAKE_ELEVATION],
+                                                       all_soundings=[sorted_soundings],
+                                                       latitudes=latitudes,
+                                                       longitudes=longitudes,
+                                                       elevations=elevations)
+    expected_depths, _ = assign_one_at_a_time(terrain_model, [LAKE_ELEVATION], [soundings],
+                                              latitudes, longitudes, elevations)
+    np.testing.assert_array_equal(depths, expected_depths)
+    assert not np.array_equal(sorted_depths, expected_depths, equal_nan=True)